@@ -1,4 +1,5 @@
 from __future__ import annotations
+from typing import Any
 
 from service.errors import Errors
 
@@ -8,9 +9,21 @@ ERRORS_MAP: dict[str, tuple[str, int]] = {
     Errors.NO_BOT: ('Bot already deleted', 303),
     Errors.NO_BALANCERS: ('Service is currently unavailable', 503),
     Errors.NO_WORKERS: ('Service is currently unavailable', 503),
-    Errors.PUBLISH_ERROR: ('Service is currently unavailable', 503)
+    Errors.PUBLISH_ERROR: ('Service is currently unavailable', 503),
+    Errors.WORKER_CRASHED: ('Service is currently unavailable', 503),
+    Errors.RPC_TIMEOUT: ('Service did not respond in time', 504)
 }
 
 
 def translate_error_code(error: str, default_code=503):
     return ERRORS_MAP.get(error, (error, default_code))
+
+
+def translate_create_status(status: dict[str, Any]):
+    if status['state'] == 'pending':
+        return 'Bot creation pending', 202
+    if status['state'] == 'created':
+        return 'Bot created', 200
+    if status.get('error'):
+        return translate_error_code(status['error'])
+    return status['message'], status['status_code']
@@ -10,6 +10,9 @@ if TYPE_CHECKING:
 
 async def service_exception_handler(request: AppRequest, exc: LambServiceException):
     status_code = exc.extra['status_code']
-    return JSONResponse(
-        content={'status': status_code, 'message': exc.extra['message']},
-        status_code=status_code)
+    content = {'status': status_code, 'message': exc.extra['message']}
+    headers = None
+    if 'retry_after' in exc.extra:
+        content['retry_after'] = exc.extra['retry_after']
+        headers = {'Retry-After': str(exc.extra['retry_after'])}
+    return JSONResponse(content=content, status_code=status_code, headers=headers)
@@ -5,28 +5,31 @@ import asyncio
 
 from lamb.utils.cryptography import (
     generate_random_string,
-    validate_base64_signed,
-    base64_sign_value
+    base64_sign_value,
+    Base64SignedValidator
 )
 
 from service.exceptions import ValidationError
 
+from service.errors import Errors
+
 from fastapi import APIRouter, Response, Depends
 
 from .types import AppRequest, AppWebSocket
 from .models import BotInfo
 from .config import config
-from .errors import translate_error_code
+from .errors import translate_error_code, translate_create_status
 
 
 ALTCHARS = b'-_'
 
 
 router = APIRouter()
+session_id_validator = Base64SignedValidator('session', config.SECRET, altchars=ALTCHARS)
 
 
 async def validate_session_id(session_id: str):
-    if not validate_base64_signed(session_id, 'session', config.SECRET, altchars=ALTCHARS):
+    if not session_id_validator(session_id):
         raise ValidationError('Invalid session id')
     return session_id
 
@@ -56,13 +59,34 @@ async def bot_get(request: AppRequest, response: Response,
     return {'status': response.status_code, 'message': message, 'session': session}
 
 
+@router.get('/bot/status')
+async def bot_status_get(request: AppRequest, response: Response,
+                         session_id: Annotated[str, Depends(validate_session_id)]):
+    service = request.app.state.service
+    status = await service.redis.get_create_status(session_id)
+    if status:
+        message, response.status_code = translate_create_status(status)
+    else:
+        message, response.status_code = 'No pending bot creation', 404
+
+    return {'status': response.status_code, 'message': message,
+            'state': status['state'] if status else None,
+            'position': service.create_position(session_id)}
+
+
 @router.post('/bot')
-async def bot_post(request: AppRequest, response: Response, info: BotInfo):
+async def bot_post(request: AppRequest, response: Response, info: BotInfo, wait: bool = True):
     session_id = base64_sign_value(
         generate_random_string(22), 'session', config.SECRET, altchars=ALTCHARS)
 
     service = request.app.state.service
-    error = await service.create_bot(session_id, **info.model_dump())
+    client_ip = request.client.host if request.client else None
+    if not wait:
+        await service.enqueue_create_bot(session_id, **info.model_dump(), client_ip=client_ip)
+        response.status_code = 202
+        return {'status': 202, 'message': 'Bot creation pending', 'session_id': session_id}
+
+    error = await service.create_bot(session_id, **info.model_dump(), client_ip=client_ip)
     if error:
         message, response.status_code = translate_error_code(error)
     else:
@@ -70,7 +94,7 @@ async def bot_post(request: AppRequest, response: Response, info: BotInfo):
 
     return {'status': response.status_code,
             'message': message,
-            'session_id': session_id if not error else None}
+            'session_id': session_id if not error or error == Errors.RPC_TIMEOUT else None}
 
 
 @router.delete('/bot')
@@ -94,9 +118,48 @@ async def bot_ws_session(websocket: AppWebSocket,
                          session_id: Annotated[str, Depends(validate_session_id)]):
     service = websocket.app.state.service
     await websocket.accept()
-    while True:
-        await asyncio.sleep(5)
-        session_list = await service.redis.get_session_json(session_id, '$.bot')
-        if not session_list:
-            return await websocket.close(code=1000, reason='Bot disconnected')
-        await websocket.send_json(session_list[0])
+
+    async def send_position(position: int):
+        await websocket.send_json({'status': 202, 'message': 'Bot creation queued',
+                                   'state': 'pending', 'position': position})
+
+    status = await service.wait_create_status(session_id, on_position=send_position)
+    if status:
+        message, code = translate_create_status(status)
+        await websocket.send_json({'status': code, 'message': message, 'state': status['state']})
+        if status['state'] == 'failed':
+            return await websocket.close(code=1000, reason='Bot creation failed')
+    queue = await service.events.subscribe(session_id)
+    receiver = asyncio.ensure_future(websocket.receive())
+    getter = asyncio.ensure_future(queue.get())
+    event: dict | None = {'type': 'resync'}
+    try:
+        while True:
+            if event is None:
+                pass
+            elif event['type'] == 'resync':
+                bot = service.events.states.get(session_id)
+                if bot is None:
+                    return await websocket.close(code=1000, reason='Bot disconnected')
+                await websocket.send_json(bot)
+            elif event['type'] == 'closed':
+                return await websocket.close(code=1000, reason='Bot disconnected')
+            else:
+                await websocket.send_json(event)
+
+            event = None
+            done, pending = await asyncio.wait(
+                (getter, receiver), timeout=30, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                if receiver.result()['type'] == 'websocket.disconnect':
+                    return
+                receiver = asyncio.ensure_future(websocket.receive())
+            if getter in done:
+                event = getter.result()
+                getter = asyncio.ensure_future(queue.get())
+            elif not done and not await service.redis.check_session_exists(session_id):
+                event = {'type': 'closed'}
+    finally:
+        receiver.cancel()
+        getter.cancel()
+        await service.events.unsubscribe(session_id, queue)
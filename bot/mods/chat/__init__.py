@@ -61,6 +61,7 @@ class Room:
             'join': JoinMessage
         }
         self.update_time = 0
+        self.messages_count = 0
         self.connected = False
         self.url = None
         self.dj_mode = False
@@ -156,6 +157,7 @@ class Room:
         messages = room_json.get('talks')
         if self.update_time and messages:
             messages = self.process_messages(messages)
+            self.messages_count += len(messages)
         else:
             messages = []
 
@@ -5,6 +5,8 @@ import time
 import copy
 from attrs import define
 
+from lamb.utils.oplog import OperationLog
+
 from ..spec import CommandSpec, FlagSpec, process_spec
 
 from .groups import BaseGroup, GroupsManager
@@ -55,12 +57,15 @@ class Profile:
     default_settings: dict[str, dict[str, str]]
     default_grouptypes: dict[str, Type[BaseGroup]]
 
+    admin: dict[str, Any]
+    bot: dict[str, Any]
     blacklist: dict[str, Any]
     whitelist: dict[str, Any]
     translations: dict[str, Any]
     permits: dict[str, int]
 
     def __init__(self):
+        self.oplog = OperationLog()
         self.default_grouptypes = {'default': DefaultGroup}
         self.default_settings = {
             'general': {
@@ -81,7 +86,7 @@ class Profile:
         self.permits = d['permits']
 
         self.groups_manager = GroupsManager(
-            d['groups'], self.permits, self.default_grouptypes)
+            d['groups'], self.permits, self.default_grouptypes, self.oplog)
         self.commands = process_spec(
             d['commands'], self.command_spec, self.flag_spec)
         self.settings = process_settings(d['settings'], self.default_settings)
@@ -114,22 +119,27 @@ class Profile:
 
     def add_to_whitelist(self, name: str):
         self.whitelist[name] = time.time()
+        self.oplog.set('whitelist', (name,), self.whitelist[name])
 
     def remove_from_whitelist(self, name: str):
-        self.whitelist.pop(name, None)
+        if self.whitelist.pop(name, None) is not None:
+            self.oplog.delete('whitelist', (name,))
 
     def add_to_blacklist(self, name: str, reason: Optional[str] = None, permanent: bool = False):
         if permanent:
             self.blacklist[name] = {'status': 'permanent', 'reason': reason}
         else:
             self.blacklist[name] = {'status': 'commands', 'reason': reason}
+        self.oplog.set('blacklist', (name,), self.blacklist[name])
 
     def remove_from_blacklist(self, name: str, full: bool = False):
         if name in self.blacklist:
             if full:
                 self.blacklist.pop(name)
+                self.oplog.delete('blacklist', (name,))
             else:
                 self.blacklist[name]['status'] = 'commands'
+                self.oplog.set('blacklist', (name, 'status'), 'commands')
 
     def user_groups(self, name: str, tripcode: str):
         for group in self.groups_manager.groups.values():
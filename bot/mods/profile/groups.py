@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Type, Any, Optional
+from typing import TYPE_CHECKING, Type, Any, Optional
 
 from attrs import define, field, asdict
 
@@ -9,6 +9,9 @@ from .exceptions import (
     GroupTypeNotExistsError
 )
 
+if TYPE_CHECKING:
+    from lamb.utils.oplog import OperationLog
+
 
 @define
 class BaseGroup:
@@ -31,8 +34,10 @@ class GroupsManager:
     groups: dict[str, BaseGroup]
 
     def __init__(self, src: dict[str, Any], permits: dict[str, int],
-                 types: Optional[dict[str, Type[BaseGroup]]] = None):
+                 types: Optional[dict[str, Type[BaseGroup]]] = None,
+                 oplog: Optional[OperationLog] = None):
         self.groups_src = src
+        self.oplog = oplog
         self.permits = permits
         self.types = {}
         self.groups = {}
@@ -62,8 +67,22 @@ class GroupsManager:
     def remove_group(self, name: str):
         self.groups.pop(name, None)
 
+    def record_user(self, group: BaseGroup, name: str):
+        if self.oplog is None:
+            return
+        if name in group.users:
+            self.oplog.set('groups', (group.name, 'users', name), group.users[name])
+        else:
+            self.oplog.delete('groups', (group.name, 'users', name))
+
     def add_user(self, group: str, *args, **kwargs):
-        return self.get_group(group).add_user(*args, **kwargs)
+        instance = self.get_group(group)
+        result = instance.add_user(*args, **kwargs)
+        self.record_user(instance, args[0] if args else kwargs['name'])
+        return result
 
     def remove_user(self, group: str, *args, **kwargs):
-        return self.get_group(group).remove_user(*args, **kwargs)
+        instance = self.get_group(group)
+        result = instance.remove_user(*args, **kwargs)
+        self.record_user(instance, args[0] if args else kwargs['name'])
+        return result
@@ -0,0 +1,95 @@
+from __future__ import annotations
+from typing import Any, Callable, Awaitable, Generic, Hashable, TypeVar, Optional
+
+import time
+import asyncio
+from collections import OrderedDict
+
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+MISSING: Any = object()
+
+
+class LRUCache(Generic[K, V]):
+
+    items: OrderedDict[K, tuple[V, float | None]]
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[K, V], Any]] = None):
+        self.maxsize = max(maxsize, 1)
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key: K):
+        return self.get(key, MISSING, count=False) is not MISSING
+
+    def evict(self, key: K, value: V):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key: K, default: Any = None, count: bool = True) -> V | Any:
+        item = self.items.get(key)
+        if item is not None:
+            value, expires = item
+            if expires is None or expires > time.monotonic():
+                self.items.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            del self.items[key]
+            self.evict(key, value)
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        previous = self.items.pop(key, None)
+        if previous is not None and previous[0] is not value:
+            self.evict(key, previous[0])
+        self.items[key] = (value, None if ttl is None else time.monotonic() + ttl)
+        while len(self.items) > self.maxsize:
+            old_key, (old_value, expires) = self.items.popitem(last=False)
+            self.evict(old_key, old_value)
+
+    def pop(self, key: K, default: Any = None) -> V | Any:
+        item = self.items.pop(key, None)
+        if item is None:
+            return default
+        return item[0]
+
+    def expire(self):
+        timestamp = time.monotonic()
+        for key, (value, expires) in list(self.items.items()):
+            if expires is not None and expires <= timestamp:
+                del self.items[key]
+                self.evict(key, value)
+
+    def clear(self):
+        items = list(self.items.items())
+        self.items.clear()
+        for key, (value, expires) in items:
+            self.evict(key, value)
+
+
+class SingleFlight(Generic[K, V]):
+
+    flights: dict[K, asyncio.Future[V]]
+
+    def __init__(self):
+        self.flights = {}
+
+    async def run(self, key: K, func: Callable[[], Awaitable[V]]) -> V:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = asyncio.ensure_future(func())
+            flight.add_done_callback(lambda flight: self.flights.pop(key, None))
+        return await asyncio.shield(flight)
@@ -6,6 +6,9 @@ import hmac
 import hashlib
 import base64
 import secrets
+import functools
+
+from .cache import LRUCache
 
 
 ALPHANUMERIC = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
@@ -37,11 +40,18 @@ def hash_passcode(passcode: bytes | str, salt: Optional[str] = None, algorithm:
     return f'{algorithm}${iterations}${salt}${decoded_hash}', salt
 
 
-def salted_hmac(value: bytes | str, salt: bytes | str, secret: bytes | str, algorithm='sha256'):
-    if isinstance(value, str):
-        value = value.encode('utf-8')
-    else:
-        value = bytes(value)
+def verify_passcode(passcode: bytes | str, hashed_passcode: str):
+    try:
+        algorithm, iterations, salt, passcode_hash = hashed_passcode.split('$', 3)
+        expected_passcode, salt = hash_passcode(passcode, salt, algorithm, int(iterations))
+    except ValueError:
+        return False
+
+    return compare_digest(expected_passcode, hashed_passcode)
+
+
+@functools.lru_cache(maxsize=32)
+def keyed_hmac(salt: bytes | str, secret: bytes | str, algorithm: str = 'sha256'):
     if isinstance(salt, str):
         salt = salt.encode('utf-8')
     else:
@@ -51,7 +61,18 @@ def salted_hmac(value: bytes | str, salt: bytes | str, secret: bytes | str, algo
     else:
         secret = bytes(secret)
 
-    return hmac.new(hashlib.new(algorithm, salt + secret).digest(), value, algorithm)
+    return hmac.new(hashlib.new(algorithm, salt + secret).digest(), digestmod=algorithm)
+
+
+def salted_hmac(value: bytes | str, salt: bytes | str, secret: bytes | str, algorithm='sha256'):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    else:
+        value = bytes(value)
+
+    signature = keyed_hmac(salt, secret, algorithm).copy()
+    signature.update(value)
+    return signature
 
 
 def base64_salted_hmac(value: bytes | str, salt: bytes | str,
@@ -89,23 +110,37 @@ def base64_sign_value(value: bytes | str, salt: bytes | str, secret: bytes | str
 
 def validate_hex_signed(value: str, salt: bytes | str, secret: bytes | str,
                     separator: str = '--', algorithm: str = 'sha256'):
-    msg, *sig = value.split(separator, maxsplit=1)
-    if not sig:
+    msg, found, sig = value.partition(separator)
+    if not found:
         return False
-    if not compare_digest(value, hex_sign_value(msg, salt, secret, separator, algorithm)):
-        return False
-    else:
-        return True
+    return compare_digest(sig, hex_salted_hmac(msg, salt, secret, algorithm))
 
 
 def validate_base64_signed(value: str, salt: bytes | str, secret: bytes | str,
                     separator: str = '--', algorithm: str = 'sha256',
                     altchars: bytes | None = None):
-    msg, *sig = value.split(separator, maxsplit=1)
-    if not sig:
+    msg, found, sig = value.partition(separator)
+    if not found:
         return False
-    if not compare_digest(value, base64_sign_value(
-        msg, salt, secret, separator, algorithm, altchars)):
-        return False
-    else:
+    return compare_digest(sig, base64_salted_hmac(msg, salt, secret, algorithm, altchars))
+
+
+class Base64SignedValidator:
+
+    def __init__(self, salt: bytes | str, secret: bytes | str, separator: str = '--',
+                 algorithm: str = 'sha256', altchars: bytes | None = None, maxsize: int = 4096):
+        self.salt = salt
+        self.secret = secret
+        self.separator = separator
+        self.algorithm = algorithm
+        self.altchars = altchars
+        self.validated: LRUCache[str, bool] = LRUCache(maxsize)
+
+    def __call__(self, value: str):
+        if self.validated.get(value, False):
+            return True
+        if not validate_base64_signed(value, self.salt, self.secret, self.separator,
+                                      self.algorithm, self.altchars):
+            return False
+        self.validated.set(value, True)
         return True
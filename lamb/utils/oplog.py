@@ -0,0 +1,118 @@
+from __future__ import annotations
+from typing import Any, Iterable, Tuple
+
+import copy
+import json
+import hashlib
+from collections import deque
+
+
+Operation = Tuple[str, str, Tuple[str, ...], Any]
+
+
+def compact(operations: Iterable[Operation]) -> list[Operation]:
+    kept: list[Operation] = []
+    paths: set[tuple[str, tuple[str, ...]]] = set()
+    for operation in reversed(list(operations)):
+        name, column, path, value = operation
+        if any((column, path[:i]) in paths for i in range(1, len(path) + 1)):
+            continue
+        paths.add((column, path))
+        kept.append(operation)
+    kept.reverse()
+    return kept
+
+
+def document_digest(document: dict[str, Any]):
+    return hashlib.blake2b(json.dumps(document, sort_keys=True).encode(), digest_size=16).digest()
+
+
+def apply_operations(document: dict[str, Any], operations: Iterable[Operation]):
+    for name, column, path, value in operations:
+        target = document.setdefault(column, {})
+        for key in path[:-1]:
+            target = target.get(key)
+            if not isinstance(target, dict):
+                break
+        else:
+            if name == 'set':
+                target[path[-1]] = value
+            else:
+                target.pop(path[-1], None)
+
+
+class OperationLog:
+
+    operations: deque[Operation]
+
+    def __init__(self, maxlen: int = 1000):
+        self.maxlen = maxlen
+        self.operations = deque()
+        self.overflowed = False
+
+    def __len__(self):
+        return len(self.operations)
+
+    def append(self, operation: Operation):
+        if self.overflowed:
+            return
+        if len(self.operations) >= self.maxlen:
+            self.overflowed = True
+            return
+        self.operations.append(operation)
+
+    def set(self, column: str, path: Iterable[str], value: Any):
+        self.append(('set', column, tuple(path), copy.deepcopy(value)))
+
+    def delete(self, column: str, path: Iterable[str]):
+        self.append(('delete', column, tuple(path), None))
+
+    def drain(self) -> tuple[list[Operation], bool]:
+        operations = []
+        while True:
+            try:
+                operations.append(self.operations.popleft())
+            except IndexError:
+                break
+        overflowed, self.overflowed = self.overflowed, False
+        if overflowed:
+            self.operations.clear()
+            return [], True
+        return compact(operations), False
+
+
+class SnapshotTracker:
+
+    digests: dict[str, bytes]
+    compacted: dict[str, float]
+
+    def __init__(self, compact_interval: float):
+        self.compact_interval = compact_interval
+        self.digests = {}
+        self.compacted = {}
+
+    def collect(self, key: str, document: dict[str, Any], oplog: OperationLog,
+                timestamp: float) -> tuple[list[Operation], bool]:
+        operations, overflowed = oplog.drain()
+        if operations:
+            self.digests.pop(key, None)
+        if (not overflowed and key in self.compacted
+                and timestamp - self.compacted[key] < self.compact_interval):
+            return operations, False
+        try:
+            digest = document_digest(document)
+        except RuntimeError:
+            self.compacted.pop(key, None)
+            return operations, False
+        self.compacted[key] = timestamp
+        if self.digests.get(key) == digest:
+            return operations, False
+        self.digests[key] = digest
+        return operations, True
+
+    def retain(self, keys: Iterable[str]):
+        retained = set(keys)
+        for key in self.digests.keys() - retained:
+            del self.digests[key]
+        for key in self.compacted.keys() - retained:
+            del self.compacted[key]
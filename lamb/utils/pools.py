@@ -1,7 +1,8 @@
 from __future__ import annotations
-from typing import Type, Any
+from typing import Type, Any, Optional
 
-import types
+import time
+import asyncio
 import threading
 from collections import deque
 
@@ -45,26 +46,19 @@ class BasePool:
         return self.wrapper_cls(self.queue, self.semaphore)
 
 
-@types.coroutine
-def switch():
-    yield
-
-
 class AsyncPoolWrapper:
 
-    def __init__(self, queue: deque):
-        self.queue = queue
+    def __init__(self, pool: AsyncBasePool, timeout: Optional[float] = None):
+        self.pool = pool
+        self.timeout = timeout
         self.item = None
 
     def append_item(self):
-        self.queue.append(self.item)
+        self.pool.release(self.item)
         self.item = None
 
     async def pop_item(self):
-        queue = self.queue
-        while not queue:
-            await switch()
-        self.item = queue.popleft()
+        self.item = await self.pool.acquire(self.timeout)
         return self.item
 
     async def __aenter__(self):
@@ -78,10 +72,70 @@ class AsyncBasePool:
 
     wrapper_cls: Type[AsyncPoolWrapper] = AsyncPoolWrapper
     queue: deque[Any]
+    waiters: deque[asyncio.Future]
 
     def __init__(self, count: int):
         self.count = max(count, 1)
         self.queue = deque()
-
-    def get_item(self):
-        return self.wrapper_cls(self.queue)
+        self.waiters = deque()
+
+        self.acquired_count = 0
+        self.waits_count = 0
+        self.timeouts_count = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def waiters_count(self):
+        return len(self.waiters)
+
+    def metrics(self):
+        return {'items': len(self.queue),
+                'waiters': len(self.waiters),
+                'acquired': self.acquired_count,
+                'waits': self.waits_count,
+                'timeouts': self.timeouts_count,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time}
+
+    def release(self, item: Any):
+        waiters = self.waiters
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(item)
+                return
+        self.queue.append(item)
+
+    async def acquire(self, timeout: Optional[float] = None):
+        if self.queue and not self.waiters:
+            self.acquired_count += 1
+            return self.queue.popleft()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.waits_count += 1
+        start = time.monotonic()
+        try:
+            item = await asyncio.wait_for(waiter, timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            else:
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts_count += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+        self.acquired_count += 1
+        return item
+
+    def get_item(self, timeout: Optional[float] = None):
+        return self.wrapper_cls(self, timeout)
@@ -105,6 +105,9 @@ class BaseRequestHandler:
     def handle(self, conn, data):
         pass
 
+    def closed(self, conn):
+        pass
+
 
 class SocketServer:
 
@@ -200,13 +203,16 @@ class SocketServer:
             data = conn.recv()
         except ConnectionError:
             self.close_sock(conn.sock)
+            self.request_handler.closed(conn)
             return
         try:
             self.request_handler.handle(conn, data)
         except ConnectionError:
             self.close_sock(conn.sock)
+            self.request_handler.closed(conn)
         except Exception as e:
             self.close_sock(conn.sock)
+            self.request_handler.closed(conn)
             logger.exception(e)
             if self.raise_exceptions:
                 raise
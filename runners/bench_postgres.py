@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+import asyncpg
+
+from lamb.utils.metrics import Registry
+from service.providers.hasher import PasscodeHasher
+from service.providers.postgres import PostgresProvider
+
+
+async def legacy_upsert(pool: asyncpg.Pool, hasher: PasscodeHasher, user_name: str,
+                        user_tripcode: str, user_passcode: str, bot_name: str, bot_passcode: str):
+    async with pool.acquire() as conn:
+        user = await conn.fetchrow("""
+            SELECT id, name, tripcode FROM users
+            WHERE name = $1 AND tripcode = $2
+            """, user_name, user_tripcode)
+    if not user:
+        hashed_passcode, salt = await hasher.hash(user_passcode)
+        async with pool.acquire() as conn:
+            user = await conn.fetchrow("""
+                INSERT INTO users (name, tripcode, passcode, salt)
+                VALUES ($1, $2, $3, $4)
+                RETURNING id, name, tripcode
+                """, user_name, user_tripcode, hashed_passcode, salt)
+    async with pool.acquire() as conn:
+        bot = await conn.fetchrow("""
+            WITH ins AS(
+                INSERT INTO bots (name, passcode, user_id)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE
+                    SET name = $1, passcode = $2
+                RETURNING name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id
+            )
+            SELECT name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id FROM ins
+            UNION
+            SELECT name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id FROM bots
+            WHERE user_id = $3
+            """, bot_name, bot_passcode, user['id'])
+
+    return user, bot
+
+
+async def measure(name: str, func, users: int, iterations: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    durations: list[float] = []
+
+    async def call(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await func(f'bench{i % users}', 'bench', '##benchpass', f'benchbot{i % users}', '##benchbotpass')
+            durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    durations.sort()
+    print(f'{name:>8}: {iterations / elapsed:8.1f} ops/s  '
+          f'mean {statistics.mean(durations) * 1000:6.2f}ms  '
+          f'p50 {durations[len(durations) // 2] * 1000:6.2f}ms  '
+          f'p99 {durations[int(len(durations) * 0.99)] * 1000:6.2f}ms')
+
+
+async def main(args: argparse.Namespace):
+    settings = {
+        'host': args.host, 'port': args.port, 'user': args.user,
+        'password': args.password, 'database': args.database,
+        'min_size': args.concurrency, 'max_size': args.concurrency}
+
+    hasher = PasscodeHasher(Registry(), 2, args.iterations)
+    postgres = PostgresProvider(hasher)
+    await postgres.init(**settings)
+    pool = await asyncpg.create_pool(**settings)
+    try:
+        # warm up so both paths only measure the existing user case
+        await measure('warmup', postgres.upsert_user_bot, args.users, args.users, args.concurrency)
+        for _ in range(args.rounds):
+            await measure('legacy', lambda *a: legacy_upsert(pool, hasher, *a),
+                          args.users, args.iterations, args.concurrency)
+            await measure('combined', postgres.upsert_user_bot,
+                          args.users, args.iterations, args.concurrency)
+    finally:
+        await pool.close()
+        await postgres.close()
+        hasher.close()
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser()
+    p.add_argument('--host', default=os.environ.get('POSTGRES_HOST', 'localhost'))
+    p.add_argument('--port', type=int, default=int(os.environ.get('POSTGRES_PORT', 5432)))
+    p.add_argument('--user', default=os.environ.get('POSTGRES_USER', 'postgres'))
+    p.add_argument('--password', default=os.environ.get('POSTGRES_PASSWORD'))
+    p.add_argument('--database', default=os.environ.get('POSTGRES_DB', 'postgres'))
+    p.add_argument('-u', '--users', type=int, default=100)
+    p.add_argument('-n', '--iterations', type=int, default=5000)
+    p.add_argument('-c', '--concurrency', type=int, default=10)
+    p.add_argument('-r', '--rounds', type=int, default=3)
+    args = p.parse_args()
+
+    asyncio.run(main(args))
@@ -1,54 +1,184 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Any
 
+import time
 import datetime
 import json
 import pickle
 import signal
+import random
 import socket
 import asyncio
 import threading
 import multiprocessing
-from heapq import heapify
 from collections import deque
 
 import asyncpg
-import aio_pika
 import redis.asyncio as redis
 
 from lamb.utils.locks import AsyncLocksProxy
+from lamb.utils.metrics import Registry, Histogram, MetricsServer
 from lamb.utils.sockets import SocketServer, ConnectionHandler, BaseRequestHandler
+from lamb.utils.oplog import Operation, compact, apply_operations
 
+from .errors import Errors
 from .manager import start_bot_manager
+from .providers.transport import create_balancer_transport
+from .providers.postgres import set_json_codecs
+from .providers.events import events_channel
+from .providers.router import CLAIM_SCRIPT, RELEASE_SCRIPT
+from .providers.create_queue import CAPACITY_CHANNEL
 from .bot.extractor import connect_extractor_server
+from .logging.logger import logger
 
 if TYPE_CHECKING:
     from asyncio import AbstractEventLoop, Future
-    from aio_pika.abc import AbstractIncomingMessage
+    from redis.asyncio.client import Pipeline
+    from .providers.transport import Request, BaseBalancerTransport
 
 
 async def write_session(conn, whitelist, blacklist, groups, user_id, **kwargs):
     return await conn.execute("""
         UPDATE bots SET whitelist = $1, blacklist = $2, groups = $3
         WHERE user_id = $4
-        """, json.dumps(whitelist), json.dumps(blacklist), json.dumps(groups), user_id)
+        """, whitelist, blacklist, groups, user_id)
+
+
+async def write_sessions(conn, bots: list[dict[str, Any]]):
+    return await conn.executemany("""
+        UPDATE bots SET whitelist = $1, blacklist = $2, groups = $3
+        WHERE user_id = $4
+        """, [(bot['whitelist'], bot['blacklist'], bot['groups'], bot['user_id']) for bot in bots])
+
+
+async def copy_sessions(conn, bots: list[dict[str, Any]]):
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE TEMP TABLE bots_update (
+                user_id bigint, whitelist jsonb, blacklist jsonb, groups jsonb
+            ) ON COMMIT DROP
+            """)
+        await conn.copy_records_to_table(
+            'bots_update', columns=('user_id', 'whitelist', 'blacklist', 'groups'),
+            records=[(bot['user_id'], bot['whitelist'], bot['blacklist'], bot['groups']) for bot in bots])
+        return await conn.execute("""
+            UPDATE bots SET whitelist = u.whitelist, blacklist = u.blacklist, groups = u.groups
+            FROM bots_update u
+            WHERE bots.user_id = u.user_id
+            """)
+
+
+PATCH_QUERIES = {
+    ('set', column): f"""
+        UPDATE bots SET {column} = jsonb_set(COALESCE({column}, '{{}}'), $2, $3)
+        WHERE user_id = $1
+        """ for column in ('whitelist', 'blacklist', 'groups')}
+PATCH_QUERIES.update({
+    ('delete', column): f"""
+        UPDATE bots SET {column} = {column} #- $2
+        WHERE user_id = $1
+        """ for column in ('whitelist', 'blacklist', 'groups')})
+
+
+async def patch_sessions(conn, patches: list[tuple[str, int, str, list[str], Any]]):
+    grouped: dict[tuple[str, str], list[tuple[Any, ...]]] = {}
+    for operation, user_id, column, path, value in patches:
+        params = (user_id, path, value) if operation == 'set' else (user_id, path)
+        grouped.setdefault((operation, column), []).append(params)
+    async with conn.transaction():
+        for key, batch in grouped.items():
+            await conn.executemany(PATCH_QUERIES[key], batch)
+
+
+def json_path(column: str, path: tuple[str, ...]):
+    return f'$.bot.{column}' + ''.join(f'[{json.dumps(key)}]' for key in path)
+
+
+def merge_patch(previous: tuple[str, Any, Any, Any], signal: tuple[str, Any, Any, Any]):
+    name, data, session_id, error = previous
+    user_id, operations = signal[1]
+    if name == 'update':
+        apply_operations(data['bot'], operations)
+        return previous
+    return ('patch', (user_id, compact(data[1] + operations)), session_id, error)
+
+
+class TrackedPipeline(redis.client.Pipeline):
+
+    latency: Histogram
+
+    async def execute(self, raise_on_error: bool = True):
+        with self.latency.time('PIPELINE'):
+            return await super().execute(raise_on_error)
+
+
+class TrackedRedis(redis.Redis):
+
+    latency: Histogram
+
+    async def execute_command(self, *args, **options):
+        with self.latency.time(args[0]):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None):
+        pipeline = TrackedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.latency = self.latency
+        return pipeline
+
+
+LOAD_WEIGHTS = {
+    'instances': 1.0,
+    'loop_lag': 10.0,
+    'cpu': 1.0,
+    'messages_rate': 0.01,
+    'threads': 0.001}
 
 
 class Worker:
 
-    def __init__(self, server: SocketServer, extractor_address: tuple[str, int]):
+    context = multiprocessing.get_context('spawn')
+
+    load: dict[str, float]
+
+    def __init__(self, server: SocketServer, extractor_address: tuple[str, int], instances_count: int):
         self.server = server
         self.extractor_address = extractor_address
+        self.instances_count = instances_count
         self.running_instances = 0
-
-    def __lt__(self, other: Any):
-        return self.running_instances < other.running_instances
+        self.idle_timestamp: float | None = time.monotonic()
+        self.draining = False
+        self.crashed = False
+        self.heartbeat_timestamp = time.monotonic()
+        self.creating: set[str] = set()
+        self.deleting: set[str] = set()
+        self.load = {'loop_lag': 0.0, 'cpu': 0.0, 'messages_rate': 0.0, 'threads': 0}
+
+    @property
+    def available(self):
+        return not self.draining and self.running_instances < self.instances_count
+
+    @property
+    def free_slots(self):
+        return max(self.instances_count - self.running_instances, 0)
+
+    def load_score(self):
+        load = self.load
+        return (LOAD_WEIGHTS['instances'] * self.running_instances / self.instances_count
+                + LOAD_WEIGHTS['loop_lag'] * load['loop_lag']
+                + LOAD_WEIGHTS['cpu'] * load['cpu']
+                + LOAD_WEIGHTS['messages_rate'] * load['messages_rate']
+                + LOAD_WEIGHTS['threads'] * load['threads'])
 
     def start(self):
-        self.process = multiprocessing.Process(
+        self.ready: Future[None] = asyncio.get_running_loop().create_future()
+        self.process = self.context.Process(
             target=start_bot_manager, args=(self.server.address, self.extractor_address), daemon=True)
         self.process.start()
-        self.connection = self.server.accept()
+
+    def attach(self, connection: ConnectionHandler):
+        self.connection = connection
+        if not self.ready.done():
+            self.ready.set_result(None)
 
     def stop(self):
         self.running_instances = 0
@@ -56,12 +186,247 @@ class Worker:
 
     def create_instance(self, session_id: str, session: dict[str, Any]):
         self.running_instances += 1
+        self.idle_timestamp = None
+        self.creating.add(session_id)
         self.connection.send(pickle.dumps(('create', (session_id, session))))
 
     def delete_instance(self, session_id: str):
-        self.running_instances -= 1
+        self.release_instance()
+        self.deleting.add(session_id)
         self.connection.send(pickle.dumps(('delete', (session_id,))))
 
+    def release_instance(self):
+        self.running_instances -= 1
+        if not self.running_instances:
+            self.idle_timestamp = time.monotonic()
+
+
+class WorkersIndex:
+
+    workers: list[Worker]
+    available: list[Worker]
+    positions: dict[Worker, int]
+
+    def __init__(self):
+        self.workers = []
+        self.available = []
+        self.positions = {}
+
+    def __iter__(self):
+        return iter(self.workers)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def add(self, worker: Worker):
+        self.workers.append(worker)
+        self.update(worker)
+
+    def remove(self, worker: Worker):
+        self.workers.remove(worker)
+        self.discard(worker)
+
+    def update(self, worker: Worker):
+        if not worker.available:
+            self.discard(worker)
+        elif worker not in self.positions:
+            self.positions[worker] = len(self.available)
+            self.available.append(worker)
+
+    def discard(self, worker: Worker):
+        position = self.positions.pop(worker, None)
+        if position is None:
+            return
+        last = self.available.pop()
+        if last is not worker:
+            self.available[position] = last
+            self.positions[last] = position
+
+    def choose(self):
+        available = self.available
+        if not available:
+            return min((worker for worker in self.workers if not worker.draining),
+                       key=Worker.load_score, default=None)
+        if len(available) == 1:
+            return available[0]
+        first, second = random.sample(available, 2)
+        if first.load_score() <= second.load_score():
+            return first
+        return second
+
+
+class BalancerMetrics:
+
+    def __init__(self, balancer: LoadBalancer):
+        self.balancer = balancer
+        self.registry = Registry()
+        self.registry.gauge('lamb_worker_running_bots', 'Bots running on a worker',
+                            ('worker',), self.running_bots)
+        self.registry.gauge('lamb_worker_load', 'Load reported by a worker',
+                            ('worker', 'metric'), self.workers_load)
+        self.registry.gauge('lamb_balancer_workers', 'Workers of the balancer by state',
+                            ('state',), self.workers_states)
+        self.registry.gauge('lamb_balancer_signals_queue', 'Worker signals waiting to be processed',
+                            ('lane',), balancer.signals_queue.depths)
+        self.signals_delay = self.registry.histogram(
+            'lamb_balancer_signals_delay_seconds', 'Time worker signals wait in their lane', ('lane',))
+        self.extractor_queue = self.registry.gauge(
+            'lamb_extractor_queue', 'Extraction requests waiting for an extractor')
+        self.commands = self.registry.counter(
+            'lamb_worker_commands_total', 'Bot commands handled by workers', ('command',))
+        self.failures = self.registry.counter(
+            'lamb_worker_failures_total', 'Bot commands failed on workers', ('command',))
+        self.latency = self.registry.histogram(
+            'lamb_worker_command_seconds', 'Bot command latency on workers', ('command',))
+        self.redis_latency = self.registry.histogram(
+            'lamb_balancer_redis_seconds', 'Redis call latency', ('command',))
+        self.postgres_latency = self.registry.histogram(
+            'lamb_balancer_postgres_seconds', 'Postgres query latency', ('query',))
+        self.transport_latency = self.registry.histogram(
+            'lamb_balancer_transport_seconds', 'Broker transport call latency', ('operation',))
+        self.registry.add_collector(self.collect_extractor)
+
+    def running_bots(self):
+        return [((worker.process.pid,), worker.running_instances) for worker in self.balancer.workers]
+
+    def workers_load(self):
+        return [((worker.process.pid, metric), value)
+                for worker in self.balancer.workers for metric, value in worker.load.items()]
+
+    def workers_states(self):
+        workers = self.balancer.workers
+        draining = sum(worker.draining for worker in workers)
+        return [(('active',), len(workers) - draining), (('draining',), draining),
+                (('spawning',), len(self.balancer.spawning))]
+
+    def observe(self, stats: dict[str, tuple[list[float], int]]):
+        for command, (durations, failures) in stats.items():
+            for duration in durations:
+                self.latency.observe(duration, command)
+            self.commands.inc(command, amount=len(durations))
+            if failures:
+                self.failures.inc(command, amount=failures)
+
+    async def collect_extractor(self):
+        if self.balancer.extractor_connection is None:
+            return
+        stats = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(None, self.balancer.extractor_stats), timeout=1)
+        self.extractor_queue.set(stats['queue'])
+
+
+class ProfileWriter:
+
+    dirty: dict[int, dict[str, Any]]
+    patches: dict[int, list[Operation]]
+
+    def __init__(self, balancer: LoadBalancer):
+        self.balancer = balancer
+        self.dirty = {}
+        self.patches = {}
+        self.lock = asyncio.Lock()
+
+    def add(self, bot: dict[str, Any]):
+        self.dirty[bot['user_id']] = bot
+        self.patches.pop(bot['user_id'], None)
+
+    def patch(self, user_id: int, operations: list[Operation]):
+        bot = self.dirty.get(user_id)
+        if bot is not None:
+            apply_operations(bot, operations)
+        else:
+            self.patches[user_id] = compact(self.patches.get(user_id, []) + operations)
+
+    async def write(self, bot: dict[str, Any]):
+        async with self.lock:
+            self.dirty.pop(bot['user_id'], None)
+            self.patches.pop(bot['user_id'], None)
+            await self.balancer.write_session(**bot)
+
+    async def flush(self):
+        async with self.lock:
+            if not self.dirty and not self.patches:
+                return
+            bots = list(self.dirty.values())
+            patches = self.patches
+            self.dirty = {}
+            self.patches = {}
+            try:
+                await self.balancer.write_sessions(bots)
+                await self.balancer.patch_sessions([
+                    (name, user_id, column, list(path), value)
+                    for user_id, operations in patches.items()
+                    for name, column, path, value in operations])
+            except BaseException:
+                for bot in bots:
+                    self.dirty.setdefault(bot['user_id'], bot)
+                for user_id, operations in patches.items():
+                    if user_id not in self.dirty:
+                        self.patches[user_id] = compact(operations + self.patches.get(user_id, []))
+                raise
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+
+class SignalLanes:
+
+    lanes = ('reply', 'lifecycle', 'update')
+    replies = frozenset(('connected', 'failed', 'deleted'))
+    terminal = frozenset(('deleted', 'disconnected'))
+
+    reply: deque[tuple[ConnectionHandler, tuple[str, Any, Any, Any], float]]
+    lifecycle: deque[tuple[ConnectionHandler, tuple[str, Any, Any, Any], float]]
+    update: dict[str, tuple[ConnectionHandler, tuple[str, Any, Any, Any], float]]
+
+    def __init__(self):
+        self.reply = deque()
+        self.lifecycle = deque()
+        self.update = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.reply) + len(self.lifecycle) + len(self.update)
+
+    def depths(self):
+        return [((lane,), len(getattr(self, lane))) for lane in self.lanes]
+
+    def append(self, conn: ConnectionHandler, signal: tuple[str, Any, Any, Any]):
+        with self.lock:
+            self.push(conn, signal)
+
+    def push(self, conn: ConnectionHandler, signal: tuple[str, Any, Any, Any]):
+        name, session, session_id, error = signal
+        timestamp = time.monotonic()
+        if name in ('update', 'patch'):
+            previous = self.update.pop(session_id, None)
+            if previous is None:
+                self.update[session_id] = (conn, signal, timestamp)
+            else:
+                if name == 'patch':
+                    signal = merge_patch(previous[1], signal)
+                self.update[session_id] = (conn, signal, previous[2])
+            return
+        if name in self.terminal:
+            self.update.pop(session_id, None)
+        lane = self.reply if name in self.replies else self.lifecycle
+        lane.append((conn, signal, timestamp))
+
+    def pop(self):
+        with self.lock:
+            for lane in self.lanes:
+                signals = getattr(self, lane)
+                if signals:
+                    batch = list(signals.values() if lane == 'update' else signals)
+                    signals.clear()
+                    return lane, batch
+        return None
+
 
 class BalancerRequestHandler(BaseRequestHandler):
 
@@ -70,7 +435,13 @@ class BalancerRequestHandler(BaseRequestHandler):
         self.signals_queue = balancer.signals_queue
 
     def handle(self, conn: ConnectionHandler, data: bytes):
-        self.signals_queue.append((conn, pickle.loads(data)))
+        if data == b'crashed':
+            self.signals_queue.append(conn, ('crashed', None, None, None))
+        else:
+            self.signals_queue.append(conn, pickle.loads(data))
+
+    def closed(self, conn: ConnectionHandler):
+        self.signals_queue.append(conn, ('crashed', None, None, None))
 
 
 class BalancerCommands:
@@ -82,88 +453,201 @@ class BalancerCommands:
         self.messages = balancer.messages
         self.redis = balancer.redis
 
-    async def create(self, message: AbstractIncomingMessage, session_id: str):
+    async def create(self, message: Request, session_id: str):
         session = await self.redis.json().get(f'session:{session_id}')
-        heapify(self.workers)
+        worker = self.workers.choose()
+        if not worker:
+            await self.balancer.release_reservation(session_id)
+            return await self.balancer.send_reply(message, Errors.NO_WORKERS.encode())
         self.messages[session_id] = message
-        self.workers[0].create_instance(session_id, session)
+        worker.create_instance(session_id, session)
+        self.workers.update(worker)
 
-    async def delete(self, message: AbstractIncomingMessage, session_id: str):
+    async def delete(self, message: Request, session_id: str):
+        recovery = self.balancer.recoveries.get(session_id)
+        if recovery:
+            await asyncio.shield(recovery)
         worker = self.sessions.pop(session_id, None)
         if worker:
             self.messages[session_id] = message
             worker.delete_instance(session_id)
+            self.workers.update(worker)
         else:
             await self.balancer.send_reply(message, b'')
 
 
 class BalancerSignals:
 
+    pipelined = frozenset(('update', 'patch', 'heartbeat'))
+
     def __init__(self, balancer: LoadBalancer):
         self.balancer = balancer
+        self.writer = balancer.writer
+        self.workers = balancer.workers
         self.sessions = balancer.sessions
         self.messages = balancer.messages
         self.connections = balancer.connections
-        self.balancer_queue = balancer.balancer_queue
+        self.signals_queue = balancer.signals_queue
+        self.pending = asyncio.Event()
         self.redis = balancer.redis
 
     async def connected(self, conn: ConnectionHandler, session: dict[str, Any],
                         session_id: str, error: str):
-        self.sessions[session_id] = self.connections[conn]
-        await self.redis.expire(f'session:{session_id}', self.balancer.SESSION_TTL)
-        await self.balancer.send_reply(self.messages.pop(session_id), b'')
+        worker = self.sessions[session_id] = self.connections[conn]
+        worker.creating.discard(session_id)
+        await self.balancer.own_session(session_id)
+        await self.balancer.complete(session_id, b'')
 
     async def failed(self, conn: ConnectionHandler, session: dict[str, Any],
                      session_id: str, error: str):
-        self.connections[conn].running_instances -= 1
-        await self.balancer.send_reply(self.messages.pop(session_id), error.encode())
+        worker = self.connections[conn]
+        worker.creating.discard(session_id)
+        worker.release_instance()
+        self.workers.update(worker)
+        await self.balancer.release_reservation(session_id)
+        await self.balancer.complete(session_id, error.encode())
 
     async def deleted(self, conn: ConnectionHandler, session: dict[str, Any],
                       session_id: str, error: str):
+        self.connections[conn].deleting.discard(session_id)
         if not error:
-            await self.balancer.write_session(**session['bot'])
-            await self.redis.json().delete(f'session:{session_id}', path='$')
-        await self.balancer.send_reply(self.messages.pop(session_id), b'')
+            await self.writer.write(session['bot'])
+            await self.balancer.release_session(session_id)
+        await self.balancer.complete(session_id, b'')
 
     async def disconnected(self, conn: ConnectionHandler, session: dict[str, Any],
                            session_id: str, error: str):
         worker = self.sessions.pop(session_id, None)
         if worker:
-            worker.running_instances -= 1
-        await self.redis.delete(f'balancers:{session_id}')
-        await self.redis.zincrby('balancers:queue', 1, self.balancer_queue.name)
-        await self.balancer.write_session(**session['bot'])
-        await self.redis.json().delete(f'session:{session_id}', path='$')
+            worker.release_instance()
+            self.workers.update(worker)
+        await self.balancer.drop_session(session_id, session['bot'])
+
+    def update(self, pipeline: Pipeline, conn: ConnectionHandler, session: dict[str, Any],
+               session_id: str, error: str):
+        pipeline.json().set(f'session:{session_id}', '$.bot', session['bot'])
+        pipeline.publish(events_channel(session_id), json.dumps({'type': 'update', 'bot': session['bot']}))
+        self.writer.add(session['bot'])
+
+    def patch(self, pipeline: Pipeline, conn: ConnectionHandler, patch: tuple[int, list[Operation]],
+              session_id: str, error: str):
+        user_id, operations = patch
+        key = f'session:{session_id}'
+        for name, column, path, value in operations:
+            if name == 'set':
+                pipeline.json().set(key, json_path(column, path), value)
+            else:
+                pipeline.json().delete(key, json_path(column, path))
+        pipeline.publish(events_channel(session_id), json.dumps({'type': 'patch', 'operations': operations}))
+        self.writer.patch(user_id, operations)
+
+    def heartbeat(self, pipeline: Pipeline, conn: ConnectionHandler, data: None,
+                  session_id: None, error: None):
+        self.connections[conn].heartbeat_timestamp = time.monotonic()
+
+    async def consume(self):
+        while True:
+            await self.pending.wait()
+            self.pending.clear()
+            while True:
+                batch = self.signals_queue.pop()
+                if batch is None:
+                    break
+                try:
+                    await self.process(*batch)
+                except Exception as e:
+                    logger.exception(e)
+
+    async def process(self, lane: str, signals: list[tuple[ConnectionHandler, tuple[str, Any, Any, Any], float]]):
+        timestamp = time.monotonic()
+        delay = self.balancer.metrics.signals_delay
+        pipeline = self.redis.pipeline(transaction=False)
+        coros = []
+        for conn, (name, *args), enqueued in signals:
+            delay.observe(timestamp - enqueued, lane)
+            if name in self.pipelined:
+                getattr(self, name)(pipeline, conn, *args)
+            else:
+                coros.append(getattr(self, name)(conn, *args))
+        if len(pipeline):
+            await pipeline.execute(raise_on_error=False)
+        for result in await asyncio.gather(*coros, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(result, exc_info=result)
+
+    async def load(self, conn: ConnectionHandler, load: dict[str, float],
+                   session_id: None, error: None):
+        self.connections[conn].load = load
+
+    async def stats(self, conn: ConnectionHandler, stats: dict[str, tuple[list[float], int]],
+                    session_id: None, error: None):
+        self.balancer.metrics.observe(stats)
+
+    async def started(self, conn: ConnectionHandler, pid: int,
+                      session_id: None, error: None):
+        worker = self.balancer.spawning.pop(pid, None)
+        if worker:
+            worker.attach(conn)
+            self.connections[conn] = worker
+            self.workers.add(worker)
 
-    async def update(self, conn: ConnectionHandler, session: dict[str, Any],
-                     session_id: str, error: str):
-        await self.redis.expire(f'session:{session_id}', self.balancer.SESSION_TTL)
-        await self.redis.json().set(f'session:{session_id}', '$.bot', session['bot'])
-        await self.balancer.write_session(**session['bot'])
+    async def crashed(self, conn: ConnectionHandler, session: None,
+                      session_id: None, error: None):
+        worker = self.connections.get(conn)
+        if worker:
+            self.balancer.recover_worker(worker)
 
 
 class LoadBalancer:
 
-    workers: list[Worker]
+    spawn_timeout: float = 30
+    scale_interval: float = 5
+    scale_cooldown: float = 30
+    idle_timeout: float = 60
+    recovery_concurrency: int = 4
+    pipeline_size: int = 1000
+    flush_interval: float = 30
+    copy_threshold: int = 500
+    lease_interval: float = 10
+    heartbeat_timeout: float = 30
+
+    workers: WorkersIndex
+    spawning: dict[int, Worker]
+    retired: list[Worker]
     connections: dict[ConnectionHandler, Worker]
     sessions: dict[str, Worker]
-    messages: dict[str, AbstractIncomingMessage]
-    signals_queue: deque[tuple[ConnectionHandler, tuple[str, Any]]]
+    messages: dict[str, Request]
+    recoveries: dict[str, Future[bytes]]
+    recovery_jobs: set[Future[None]]
+    signals_queue: SignalLanes
 
     def __init__(self, server_address: tuple[str, int], extractor_address: tuple[str, int],
-                 workers_count: int, instances_count: int):
+                 workers_count: int, instances_count: int, max_workers_count: int | None = None,
+                 extractor_connection: ConnectionHandler | None = None,
+                 metrics_address: tuple[str, int] | None = None):
         self.server_address = server_address
         self.extractor_address = extractor_address
-        self.workers_count = workers_count
+        self.extractor_connection = extractor_connection
+        self.extractor_lock = threading.Lock()
+        self.metrics_address = metrics_address
+        self.min_workers_count = workers_count
+        self.max_workers_count = max(max_workers_count or workers_count, workers_count)
         self.instances_count = instances_count
-        self.capacity = workers_count * instances_count
+        self.scale_timestamp = 0.0
+        self.closing = False
 
-        self.workers = []
+        self.workers = WorkersIndex()
+        self.spawning = {}
+        self.retired = []
         self.connections = {}
         self.sessions = {}
         self.messages = {}
-        self.signals_queue = deque()
+        self.recoveries = {}
+        self.recovery_jobs = set()
+        self.recovery_semaphore = asyncio.Semaphore(self.recovery_concurrency)
+        self.signals_queue = SignalLanes()
         self.locks = AsyncLocksProxy()
+        self.metrics = BalancerMetrics(self)
 
     async def __aenter__(self):
         return self
@@ -172,83 +656,357 @@ class LoadBalancer:
         await self.close()
 
     async def close(self):
+        self.closing = True
+        self.scaler.cancel()
+        self.flusher.cancel()
+        self.leaser.cancel()
+        for job in self.recovery_jobs:
+            job.cancel()
         for worker in self.workers:
             worker.stop()
+        for worker in self.spawning.values():
+            worker.process.terminate()
         self.server.stop()
+        if self.metrics_address:
+            await self.metrics_server.close()
         await self.finalize()
-        await self.broker_channel.close()
-        await self.broker_connection.close()
+        self.consumer.cancel()
+        await self.transport.close()
         await self.redis.close()
         await self.postgres_pool.close()
-        for worker in self.workers:
+        for worker in (*self.workers, *self.spawning.values(), *self.retired):
             worker.process.join()
 
     async def finalize(self):
-        await self.redis.zrem('balancers:queue', self.balancer_queue.name)
-        for session_id in self.sessions:
-            bot = await self.redis.json().get(f'session:{session_id}', '$.bot')
-            await self.write_session(**bot[0])
-        for session_id in self.sessions:
-            await self.redis.delete(f'balancers:{session_id}')
-            await self.redis.json().delete(f'session:{session_id}')
+        await self.redis.zrem('balancers:queue', self.name)
+        await self.writer.flush()
+        session_ids = list(self.sessions)
+        for i in range(0, len(session_ids), self.pipeline_size):
+            chunk = session_ids[i:i + self.pipeline_size]
+            pipeline = self.redis.pipeline(transaction=False)
+            for session_id in chunk:
+                pipeline.json().get(f'session:{session_id}', '$.bot')
+            bots = [bot[0] for bot in await pipeline.execute(raise_on_error=False)
+                    if bot and not isinstance(bot, Exception)]
+            await self.write_sessions(bots)
+
+            pipeline = self.redis.pipeline(transaction=False)
+            for session_id in chunk:
+                pipeline.delete(f'balancers:{session_id}')
+                pipeline.json().delete(f'session:{session_id}')
+            await pipeline.execute(raise_on_error=False)
+
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.delete(self.sessions_key)
+        pipeline.delete(f'balancers:lease:{self.name}')
+        pipeline.srem('balancers:registry', self.name)
+        await pipeline.execute()
 
     async def setup_postgres(self, **kwargs):
-        self.postgres_pool = asyncpg.create_pool(**kwargs)
+        self.postgres_pool = asyncpg.create_pool(init=set_json_codecs, **kwargs)
         await self.postgres_pool._async__init__()
 
-    async def setup_rabbitmq(self, prefetch_count: int = 0, **kwargs):
-        self.broker_connection = await aio_pika.connect(**kwargs)
-        self.broker_channel = await self.broker_connection.channel()
-        await self.broker_channel.set_qos(prefetch_count=prefetch_count)
+    async def setup_writer(self):
+        self.writer = ProfileWriter(self)
+        self.flusher = asyncio.ensure_future(self.writer.run(self.flush_interval))
 
-        self.balancers_exchange = await self.broker_channel.declare_exchange('balancers')
-        self.balancer_queue = await self.broker_channel.declare_queue(exclusive=True)
-        await self.balancer_queue.bind(self.balancers_exchange)
+    async def setup_transport(self, transport: str, **kwargs):
+        self.transport: BaseBalancerTransport = create_balancer_transport(transport, **kwargs)
+        await self.transport.init()
+        self.name = self.transport.name
 
     async def setup_redis(self, **kwargs):
-        self.redis = redis.Redis(**kwargs)
-        await self.redis.zadd('balancers:queue', {self.balancer_queue.name: self.capacity})
+        self.redis = TrackedRedis(**kwargs)
+        self.redis.latency = self.metrics.redis_latency
+        self.sessions_key = f'sessions:{self.name}'
+        self.claim_script = self.redis.register_script(CLAIM_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+        await self.renew_lease()
+        await self.redis.sadd('balancers:registry', self.name)
+        await self.reap()
+        await self.redis.zadd('balancers:queue', {self.name: 0})
+        self.leaser = asyncio.ensure_future(self.hold_lease())
 
     async def setup_commands(self):
         self.commands = BalancerCommands(self)
 
     async def setup_signals(self):
         self.signals = BalancerSignals(self)
+        self.consumer = asyncio.ensure_future(self.signals.consume())
 
     async def setup_server(self):
         self.server = SocketServer(self.server_address)
         self.server.set_request_handler(BalancerRequestHandler(self))
+        self.server_future: Future[None] = asyncio.Future()
+        threading.Thread(target=self.run_server, args=(self.server_future, asyncio.get_event_loop()),
+                         daemon=True).start()
+
+    async def setup_metrics(self):
+        if self.metrics_address:
+            self.metrics_server = MetricsServer(self.metrics.registry, self.metrics_address)
+            await self.metrics_server.start()
 
     async def setup_workers(self):
-        for i in range(self.workers_count):
-            worker = Worker(self.server, self.extractor_address)
-            worker.start()
-            self.connections[worker.connection] = worker
-            self.workers.append(worker)
+        await asyncio.gather(*(self.add_worker() for i in range(self.min_workers_count)))
+        self.scaler = asyncio.ensure_future(self.autoscale())
 
-    async def setup(self, session_ttl: int | datetime.timedelta, rabbitmq_settings: dict[str, Any],
+    async def setup(self, session_ttl: int | datetime.timedelta, transport: str, rabbitmq_settings: dict[str, Any],
                     redis_settings: dict[str, Any], postgres_settings: dict[str, Any]):
         self.SESSION_TTL = session_ttl
-        await self.setup_rabbitmq(**rabbitmq_settings)
+        await self.setup_transport(transport, **{'amqp': rabbitmq_settings,
+                                                 'redis': redis_settings}.get(transport, {}))
         await self.setup_postgres(**postgres_settings)
+        await self.setup_writer()
         await self.setup_redis(**redis_settings)
         await self.setup_commands()
         await self.setup_signals()
         await self.setup_server()
+        await self.setup_metrics()
         await self.setup_workers()
 
+    def free_slots(self):
+        return sum(worker.free_slots for worker in self.workers if not worker.draining)
+
+    def active_workers_count(self):
+        return sum(not worker.draining for worker in self.workers) + len(self.spawning)
+
+    def idle_worker(self):
+        timestamp = time.monotonic()
+        for worker in self.workers:
+            if (not worker.draining and worker.idle_timestamp is not None
+                and timestamp - worker.idle_timestamp > self.idle_timeout):
+                return worker
+        return None
+
+    async def add_worker(self):
+        worker = Worker(self.server, self.extractor_address, self.instances_count)
+        worker.start()
+        self.spawning[worker.process.pid] = worker  # type: ignore
+        try:
+            await asyncio.wait_for(asyncio.shield(worker.ready), self.spawn_timeout)
+        except asyncio.TimeoutError:
+            self.spawning.pop(worker.process.pid, None)  # type: ignore
+            worker.process.terminate()
+            self.retired.append(worker)
+            raise
+        await self.redis.zincrby('balancers:queue', worker.instances_count, self.name)
+        await self.redis.publish(CAPACITY_CHANNEL, self.name)
+
+        return worker
+
+    async def retire_worker(self, worker: Worker):
+        worker.draining = True
+        self.workers.discard(worker)
+        await self.redis.zincrby('balancers:queue', -worker.instances_count, self.name)
+
+    def reap_workers(self):
+        timestamp = time.monotonic()
+        for worker in tuple(self.workers):
+            if worker.process.exitcode is not None:
+                self.recover_worker(worker)
+            elif timestamp - worker.heartbeat_timestamp > self.heartbeat_timeout:
+                logger.error(f'Worker {worker.process.pid} stopped sending heartbeats')
+                self.recover_worker(worker)
+            elif worker.draining and not worker.running_instances:
+                worker.stop()
+                self.workers.remove(worker)
+                self.connections.pop(worker.connection, None)
+                self.retired.append(worker)
+        self.retired = [worker for worker in self.retired if worker.process.is_alive()]
+
+    async def scale(self):
+        self.reap_workers()
+        if self.spawning or time.monotonic() - self.scale_timestamp < self.scale_cooldown:
+            return
+        free_slots = self.free_slots()
+        active_count = self.active_workers_count()
+        if free_slots <= self.instances_count // 4 and active_count < self.max_workers_count:
+            self.scale_timestamp = time.monotonic()
+            await self.add_worker()
+        elif free_slots >= 2 * self.instances_count and active_count > self.min_workers_count:
+            worker = self.idle_worker()
+            if worker:
+                self.scale_timestamp = time.monotonic()
+                await self.retire_worker(worker)
+
+    async def autoscale(self):
+        while True:
+            await asyncio.sleep(self.scale_interval)
+            try:
+                await self.scale()
+            except Exception as e:
+                logger.exception(e)
+
+    def recover_worker(self, worker: Worker):
+        if self.closing or worker.crashed:
+            return
+        worker.crashed = True
+        logger.error(f'Worker {worker.process.pid} crashed, recovering its sessions')
+        self.workers.remove(worker)
+        self.connections.pop(worker.connection, None)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        self.retired.append(worker)
+
+        session_ids = [session_id for session_id, w in self.sessions.items() if w is worker]
+        for session_id in session_ids:
+            del self.sessions[session_id]
+        job = asyncio.ensure_future(self.recover_sessions(worker, session_ids))
+        self.recovery_jobs.add(job)
+        job.add_done_callback(self.recovery_jobs.discard)
+
+    async def recover_sessions(self, worker: Worker, session_ids: list[str]):
+        for session_id in worker.creating:
+            await self.complete(session_id, Errors.WORKER_CRASHED.encode())
+        for session_id in worker.deleting:
+            bot = await self.redis.json().get(f'session:{session_id}', '$.bot')
+            if bot:
+                await self.writer.write(bot[0])
+            await self.release_session(session_id)
+            await self.complete(session_id, b'')
+        if not worker.draining:
+            await self.redis.zincrby('balancers:queue', -worker.instances_count, self.name)
+
+        respawn = asyncio.ensure_future(self.add_worker())
+        await asyncio.gather(*(self.recover_session(session_id, respawn) for session_id in session_ids))
+        try:
+            await respawn
+        except Exception as e:
+            logger.exception(e)
+
+    async def recover_session(self, session_id: str, respawn: Future[Worker]):
+        async with self.recovery_semaphore:
+            future = self.recoveries[session_id] = asyncio.get_running_loop().create_future()
+            session = None
+            try:
+                session = await self.redis.json().get(f'session:{session_id}')
+                if not session:
+                    error = Errors.NO_BOT.encode()
+                else:
+                    worker = self.workers.choose()
+                    if not worker or not worker.available:
+                        worker = await asyncio.shield(respawn)
+                    worker.create_instance(session_id, session)
+                    self.workers.update(worker)
+                    error = await future
+            except Exception as e:
+                logger.exception(e)
+                error = Errors.WORKER_CRASHED.encode()
+            finally:
+                self.recoveries.pop(session_id, None)
+                if not future.done():
+                    future.set_result(b'')
+        if error:
+            await self.drop_session(session_id, session['bot'] if session else None)
+
+    async def release_reservation(self, session_id: str):
+        await self.release_script(keys=[f'balancers:{session_id}', 'balancers:queue', CAPACITY_CHANNEL],
+                                  args=[self.name])
+
+    async def drop_session(self, session_id: str, bot: dict[str, Any] | None):
+        await self.release_reservation(session_id)
+        if bot:
+            await self.writer.write(bot)
+        await self.release_session(session_id)
+
+    async def own_session(self, session_id: str):
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.json().set(f'session:{session_id}', '$.balancer', self.name)
+        pipeline.persist(f'session:{session_id}')
+        pipeline.sadd(self.sessions_key, session_id)
+        await pipeline.execute()
+        await self.claim_script(keys=[f'balancers:{session_id}', 'balancers:queue'], args=[self.name])
+
+    async def release_session(self, session_id: str):
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.json().delete(f'session:{session_id}', path='$')
+        pipeline.srem(self.sessions_key, session_id)
+        pipeline.publish(events_channel(session_id), json.dumps({'type': 'closed'}))
+        await pipeline.execute()
+
+    async def renew_lease(self):
+        await self.redis.set(f'balancers:lease:{self.name}', 1, ex=self.SESSION_TTL)
+
+    async def reap(self):
+        registry = await self.redis.smembers('balancers:registry')
+        queued = await self.redis.zrange('balancers:queue', 0, -1)
+        names = [name for name in {*registry, *queued} if name != self.name]
+        if not names:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipeline.exists(f'balancers:lease:{name}')
+        leases = await pipeline.execute()
+        for name, lease in zip(names, leases):
+            if lease:
+                continue
+            if not await self.redis.set(f'balancers:reaping:{name}', 1, nx=True, ex=self.SESSION_TTL):
+                continue
+            logger.warning(f'Balancer {name} lease expired, reaping its sessions')
+            session_ids = list(await self.redis.smembers(f'sessions:{name}'))
+            for i in range(0, len(session_ids), self.pipeline_size):
+                pipeline = self.redis.pipeline(transaction=False)
+                for session_id in session_ids[i:i + self.pipeline_size]:
+                    pipeline.delete(f'balancers:{session_id}')
+                    pipeline.delete(f'session:{session_id}')
+                await pipeline.execute(raise_on_error=False)
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.delete(f'sessions:{name}')
+            pipeline.zrem('balancers:queue', name)
+            pipeline.srem('balancers:registry', name)
+            await pipeline.execute()
+
+    async def hold_lease(self):
+        while True:
+            await asyncio.sleep(self.lease_interval)
+            try:
+                await self.renew_lease()
+                await self.reap()
+            except Exception as e:
+                logger.exception(e)
+
+    async def complete(self, session_id: str, reply_message: bytes):
+        recovery = self.recoveries.get(session_id)
+        if recovery and not recovery.done():
+            recovery.set_result(reply_message)
+            return
+        message = self.messages.pop(session_id, None)
+        if message:
+            await self.send_reply(message, reply_message)
+
     async def write_session(self, **kwargs):
         async with self.postgres_pool.acquire() as conn:
-            return await write_session(conn, **kwargs)
+            with self.metrics.postgres_latency.time('write_session'):
+                return await write_session(conn, **kwargs)
 
-    async def send_reply(self, message: AbstractIncomingMessage, reply_message: bytes):
-        if message.reply_to is None:
+    async def write_sessions(self, bots: list[dict[str, Any]]):
+        if not bots:
             return
-        await self.balancers_exchange.publish(
-            aio_pika.Message(reply_message, correlation_id=message.correlation_id), message.reply_to)
-        await message.ack()
+        async with self.postgres_pool.acquire() as conn:
+            if len(bots) >= self.copy_threshold:
+                with self.metrics.postgres_latency.time('copy_sessions'):
+                    return await copy_sessions(conn, bots)
+            with self.metrics.postgres_latency.time('write_sessions'):
+                return await write_sessions(conn, bots)
+
+    async def patch_sessions(self, patches: list[tuple[str, int, str, list[str], Any]]):
+        if not patches:
+            return
+        async with self.postgres_pool.acquire() as conn:
+            with self.metrics.postgres_latency.time('patch_sessions'):
+                return await patch_sessions(conn, patches)
+
+    async def send_reply(self, message: Request, reply_message: bytes):
+        with self.metrics.transport_latency.time('reply'):
+            await message.reply(reply_message)
+
+    def extractor_stats(self):
+        with self.extractor_lock:
+            self.extractor_connection.send(pickle.dumps(('stats', None)))  # type: ignore
+            stats, error = pickle.loads(self.extractor_connection.recv())  # type: ignore
+        return stats
 
-    async def process_message(self, message: AbstractIncomingMessage):
+    async def process_message(self, message: Request):
         command, session_id = message.body.decode().split('/')
         async with self.locks.get(session_id):
             await getattr(self.commands, command)(message, session_id)
@@ -259,11 +1017,8 @@ class LoadBalancer:
                 stop = self.server.run_once(timeout=10)
                 if stop:
                     break
-                while self.signals_queue:
-                    conn, (signal, *args) = self.signals_queue.popleft()
-                    if signal == b'crashed':
-                        break
-                    asyncio.run_coroutine_threadsafe(getattr(self.signals, signal)(conn, *args), loop)
+                if len(self.signals_queue):
+                    loop.call_soon_threadsafe(self.signals.pending.set)
         except BaseException as e:
             future.set_exception(e)
             raise
@@ -273,12 +1028,9 @@ class LoadBalancer:
                 future.set_result(None)
 
     async def run(self):
-        future = asyncio.Future()
-        loop = asyncio.get_event_loop()
-        threading.Thread(target=self.run_server, args=(future, loop), daemon=True).start()
-        await self.balancer_queue.consume(self.process_message)
+        await self.transport.consume(self.process_message)
         try:
-            return await future
+            return await self.server_future
         except asyncio.CancelledError:
             pass
 
@@ -288,13 +1040,19 @@ def parse_args():
 
     p = argparse.ArgumentParser()
     p.add_argument('-w', '--workers', type=int, required=True)
+    p.add_argument('-m', '--max-workers', type=int, default=0)
     p.add_argument('-i', '--instances', type=int, required=True)
     p.add_argument('-p', '--port', type=int, default=0)
+    p.add_argument('-M', '--metrics-port', type=int, default=9100)
+    p.add_argument('-t', '--transport', choices=('amqp', 'redis'), default='amqp')
     args = vars(p.parse_args())
 
     return {'workers_count': args['workers'],
+            'max_workers_count': args['max_workers'],
             'instances_count': args['instances'],
-            'server_port': args['port']}
+            'server_port': args['port'],
+            'metrics_port': args['metrics_port'],
+            'transport': args['transport']}
 
 
 class SigtermException(SystemExit):
@@ -305,17 +1063,21 @@ def sigterm_callback(*args):
     raise SigtermException(128 + signal.SIGTERM)
 
 
-async def main(server_port: int, workers_count: int, instances_count: int, **settings):
+async def main(server_port: int, workers_count: int, max_workers_count: int,
+               instances_count: int, metrics_port: int = 0, **settings):
     server_address = ('127.0.0.1', server_port)
+    metrics_address = ('0.0.0.0', metrics_port) if metrics_port else None
     workers_count = max(workers_count, 1)
+    max_workers_count = max(max_workers_count, workers_count)
     instances_count = max(instances_count, 1)
-    extractors_count = max((workers_count * instances_count) // 10, 1)
+    extractors_count = max((max_workers_count * instances_count) // 10, 1)
 
     signal.signal(signal.SIGTERM, sigterm_callback)
     extractor_process, extractor_address = connect_extractor_server(extractors_count)
     extractor_conn = ConnectionHandler(socket.create_connection(extractor_address))
     try:
-        async with LoadBalancer(server_address, extractor_address, workers_count, instances_count) as lb:
+        async with LoadBalancer(server_address, extractor_address, workers_count, instances_count,
+                                max_workers_count, extractor_conn, metrics_address) as lb:
             await lb.setup(**settings)
             await lb.run()
     finally:
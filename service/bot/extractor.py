@@ -82,5 +82,7 @@ class ExtractorRequestHandler(BaseRequestHandler):
         if command == 'shutdown':
             conn.close()
             self.server.shutdown()
+        elif command == 'stats':
+            conn.send(pickle.dumps(({'queue': len(self.workers.queue), 'idle': len(self.pool.queue)}, None)))
         else:
             self.workers.enqueue(self.execute_command, args=(conn, command, text))
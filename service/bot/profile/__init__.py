@@ -1,8 +1,6 @@
 from __future__ import annotations
 from typing import Any
 
-import json
-
 from bot.mods.spec import process_spec
 from bot.mods.profile import Profile as DefaultProfile
 from bot.mods.profile.groups import GroupsManager
@@ -18,8 +16,8 @@ class Profile(DefaultProfile):
         self.bot = session['bot']
         self.command_prefix = self.bot['command_prefix']
         self.language = self.bot['language']
-        self.blacklist = self.bot['blacklist'] = json.loads(self.bot['blacklist'])
-        self.whitelist = self.bot['whitelist'] = json.loads(self.bot['whitelist'])
+        self.blacklist = self.bot['blacklist']
+        self.whitelist = self.bot['whitelist']
         self.settings = {
             'general': {
                 'language': self.language,
@@ -28,7 +26,7 @@ class Profile(DefaultProfile):
             'bot': self.bot
         }
         self.permits = {"admin": 0, "moder": 1, "dj": 50, "user": 100}
-        groups = self.bot['groups'] = json.loads(self.bot['groups'])
+        groups = self.bot['groups']
         default_groups = {
             "moder": {
                 "name": "moder",
@@ -45,6 +43,6 @@ class Profile(DefaultProfile):
         }
         for k, v in default_groups.items():
             groups.setdefault(k, v)
-        self.groups_manager = GroupsManager(groups, self.permits, self.default_grouptypes)
+        self.groups_manager = GroupsManager(groups, self.permits, self.default_grouptypes, self.oplog)
         self.commands = process_spec(COMMANDS, self.command_spec, self.flag_spec)
         self.translations = TRANSLATIONS
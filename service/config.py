@@ -25,7 +25,26 @@ class Config(dict):
             'host': os.environ['REDIS_HOST'],
             'protocol': 3,
             'decode_responses': True}
+        self.TRANSPORT = os.environ.get('TRANSPORT', 'amqp')
+        self.TRANSPORT_SETTINGS = {
+            'amqp': self.RABBITMQ_SETTINGS,
+            'redis': self.REDIS_SETTINGS}.get(self.TRANSPORT, {})
+        self.METRICS_ADDRESS = ('0.0.0.0', int(os.environ.get('METRICS_PORT', 9100)))
         self.SESSION_TTL = datetime.timedelta(minutes=1)
+        self.CREATE_STATUS_TTL = datetime.timedelta(minutes=5)
+        self.RPC_TIMEOUT = 30
+        self.HASHER_WORKERS = 2
+        self.HASHER_MAX_PENDING = 64
+        self.RPC_RETRIES = 2
+        self.SESSION_CACHE_SIZE = 10000
+        self.CREATE_RATE_LIMITS = {
+            'global': (20.0, 50.0),
+            'ip': (0.5, 5.0),
+            'user': (0.2, 3.0)}
+        self.CREATE_CONCURRENCY = 32
+        self.CREATE_QUEUE_SIZE = 128
+        self.CREATE_WAIT_QUEUE_SIZE = 256
+        self.CREATE_MAX_WAIT = 20
 
         super().__init__(*args, **kwargs)
 
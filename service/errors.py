@@ -6,3 +6,5 @@ class Errors:
     NO_WORKERS = 'NO_WORKERS'
     NO_COMMAND = 'NO_COMMAND'
     PUBLISH_ERROR = 'PUBLISH_ERROR'
+    WORKER_CRASHED = 'WORKER_CRASHED'
+    RPC_TIMEOUT = 'RPC_TIMEOUT'
@@ -1,56 +1,166 @@
 from __future__ import annotations
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import asyncio
+
+from lamb.utils.metrics import Registry, MetricsServer
 
 from .providers.chat import ChatProvider
 from .providers.rd import RedisProvider
+from .providers.events import SessionEvents
 from .providers.postgres import PostgresProvider
+from .providers.hasher import PasscodeHasher
+from .providers.limiter import CreateAdmission
 from .providers.router import Router
+from .providers.create_queue import CreateQueue
+from .providers.transport import create_router_transport
 
 from .config import Config
 from .errors import Errors
+from .exceptions import LambServiceException
 from .validation import validate_create_command
+from .logging.logger import logger
+
+
+T = TypeVar('T')
 
 
 class Service:
 
     async def init(self, config: Config = Config()):
         self.config = config
+        self.metrics = Registry()
+        self.creates: dict[str, asyncio.Task[None]] = {}
+        self.stages_latency = self.metrics.histogram(
+            'lamb_create_stage_seconds', 'Bot creation latency by stage', ('stage',))
         self.chat = ChatProvider()
-        self.redis = RedisProvider(**self.config.REDIS_SETTINGS)
-        self.postgres = PostgresProvider()
+        self.redis = RedisProvider(self.metrics, config.SESSION_CACHE_SIZE, **self.config.REDIS_SETTINGS)
+        await self.redis.init()
+        self.events = SessionEvents(self.redis)
+        await self.events.init()
+        self.hasher = PasscodeHasher(self.metrics, config.HASHER_WORKERS, config.HASHER_MAX_PENDING)
+        self.postgres = PostgresProvider(self.hasher)
         await self.postgres.init(**self.config.POSTGRES_SETTINGS)
-        self.router = Router(self.redis.redis)
-        await self.router.init(**self.config.RABBITMQ_SETTINGS)
+        self.router = Router(
+            self.redis.redis, create_router_transport(config.TRANSPORT, **config.TRANSPORT_SETTINGS),
+            self.metrics, config.RPC_TIMEOUT, config.RPC_RETRIES, int(config.SESSION_TTL.total_seconds()),
+            CreateQueue(self.redis.redis, self.metrics, config.CREATE_WAIT_QUEUE_SIZE, config.CREATE_MAX_WAIT))
+        await self.router.init()
+        self.admission = CreateAdmission(
+            self.redis.redis, self.metrics, config.CREATE_RATE_LIMITS,
+            config.CREATE_CONCURRENCY, config.CREATE_QUEUE_SIZE)
+        self.metrics_server = MetricsServer(self.metrics, config.METRICS_ADDRESS)
+        await self.metrics_server.start()
 
     async def close(self):
+        for task in self.creates.values():
+            task.cancel()
+        await asyncio.gather(*self.creates.values(), return_exceptions=True)
+        await self.metrics_server.close()
         await self.chat.close()
+        await self.events.close()
         await self.redis.close()
         await self.postgres.close()
         await self.router.close()
+        self.hasher.close()
 
-    async def create_bot(self, session_id: str, user_name: str,
-                         bot_name: str, room_url: str, hidden: bool):
-        if await self.redis.check_session_exists(session_id):
-            return Errors.ALREADY_CREATED
+    async def timed(self, stage: str, awaitable: Awaitable[T]) -> T:
+        with self.stages_latency.time(stage):
+            return await awaitable
 
+    async def create_bot(self, session_id: str, user_name: str, bot_name: str,
+                         room_url: str, hidden: bool, client_ip: Optional[str] = None):
+        command = validate_create_command(user_name, bot_name, room_url, hidden)
+        await self.admission.admit(user=command.user_name, ip=client_ip)
+        return await self.admission.run(
+            lambda: self.run_create_bot(session_id, user_name, bot_name, room_url, hidden))
+
+    async def run_create_bot(self, session_id: str, user_name: str,
+                             bot_name: str, room_url: str, hidden: bool):
+        with self.stages_latency.time('total'):
+            return await self.run_create_stages(session_id, user_name, bot_name, room_url, hidden)
+
+    async def run_create_stages(self, session_id: str, user_name: str,
+                                bot_name: str, room_url: str, hidden: bool):
         command = validate_create_command(
             user_name, bot_name, room_url, hidden)
-        user_tripcode, room_name = await self.chat.get_user_info(
-            user_name, bot_name, command.room_id, hidden)
 
-        user = await self.postgres.get_or_create_user(
-            command.user_name, user_tripcode, command.user_passcode)
-        bot = await self.postgres.get_or_create_bot(
-            command.bot_name, command.bot_passcode, user['id'])
+        user_info = asyncio.ensure_future(self.timed('chat', self.chat.get_user_info(
+            user_name, bot_name, command.room_id, hidden)))
+        try:
+            if await self.timed('exists', self.redis.check_session_exists(session_id)):
+                return Errors.ALREADY_CREATED
+            user_tripcode, room_name = await user_info
+        finally:
+            user_info.cancel()
+            await asyncio.gather(user_info, return_exceptions=True)
+
+        user, bot = await self.timed('postgres', self.postgres.upsert_user_bot(
+            command.user_name, user_tripcode, command.user_passcode,
+            command.bot_name, command.bot_passcode))
 
-        await self.redis.create_session_json(
+        await self.timed('session', self.redis.create_session_json(
             session_id, self.config.SESSION_TTL, {
                 'room': {'id': command.room_id, 'url': room_url, 'name': room_name},
-                'user': user, 'bot': bot})
+                'user': user, 'bot': bot}))
 
-        error = await self.router.publish_command('create', session_id)
-        if error:
+        error = await self.timed('rpc', self.router.publish_command(
+            'create', session_id, user=f'{command.user_name}#{user_tripcode}'))
+        if error and error != Errors.RPC_TIMEOUT:
             await self.redis.delete_session_json(session_id)
-            return error
+        return error
+
+    async def enqueue_create_bot(self, session_id: str, user_name: str, bot_name: str,
+                                 room_url: str, hidden: bool, client_ip: Optional[str] = None):
+        command = validate_create_command(user_name, bot_name, room_url, hidden)
+        await self.admission.admit(user=command.user_name, ip=client_ip)
+        try:
+            await self.redis.set_create_status(session_id, {'state': 'pending'}, self.config.CREATE_STATUS_TTL)
+        except BaseException:
+            self.admission.release()
+            raise
+        task = asyncio.ensure_future(
+            self.complete_create_bot(session_id, user_name, bot_name, room_url, hidden))
+        self.creates[session_id] = task
+        task.add_done_callback(lambda task: self.creates.pop(session_id, None))
+
+    async def complete_create_bot(self, session_id: str, user_name: str,
+                                  bot_name: str, room_url: str, hidden: bool):
+        status: dict[str, Any]
+        try:
+            error = await self.admission.run(
+                lambda: self.run_create_bot(session_id, user_name, bot_name, room_url, hidden))
+        except LambServiceException as e:
+            status = {'state': 'failed', 'message': e.extra.get('message'),
+                      'status_code': e.extra.get('status_code', 503)}
+        except Exception as e:
+            logger.exception(e)
+            status = {'state': 'failed', 'message': 'Internal service error', 'status_code': 500}
+        else:
+            status = {'state': 'failed', 'error': error} if error else {'state': 'created'}
+        await self.redis.set_create_status(session_id, status, self.config.CREATE_STATUS_TTL)
+
+    def create_position(self, session_id: str) -> Optional[int]:
+        if self.router.queue is None:
+            return None
+        return self.router.queue.position(session_id)
+
+    async def wait_create_status(self, session_id: str, interval: float = 1,
+                                 on_position: Optional[Callable[[int], Awaitable[Any]]] = None):
+        position = None
+        while True:
+            status = await self.redis.get_create_status(session_id)
+            if not status or status['state'] != 'pending':
+                return status
+            current = self.create_position(session_id)
+            if on_position is not None and current is not None and current != position:
+                position = current
+                await on_position(position)
+            task = self.creates.get(session_id)
+            if task:
+                await asyncio.wait([task], timeout=interval)
+            else:
+                await asyncio.sleep(interval)
 
     async def delete_bot(self, session_id: str):
         if not await self.redis.check_session_exists(session_id):
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from typing import Any, TypeVar, Generator
 
+import os
 import time
 import pickle
 import signal
@@ -11,6 +12,7 @@ from collections import deque
 
 from lamb.utils.sockets import ConnectionHandler
 from lamb.utils.threads import ThreadsHandler
+from lamb.utils.oplog import SnapshotTracker
 
 from bot.mods.chat.exceptions import ChatApiError
 
@@ -42,37 +44,49 @@ class ManagerCommands:
         self.sentinel_selector = manager.sentinel_selector
 
     def create(self, session_id: str, session: dict[str, Any]):
+        timestamp = time.monotonic()
         bot = Bot(session, self.extractor_address, self.sentinel_selector, session_id)
         try:
             bot.login()
             bot.join_room(session['room']['url'])
         except ChatApiError as error:
             signal = pickle.dumps(('failed', session, session_id, error.msg))
+            self.manager.record('create', timestamp, failed=True)
         except Exception as e:
             logger.exception(e)
             signal = pickle.dumps(('failed', session, session_id, 'Internal service error'))
+            self.manager.record('create', timestamp, failed=True)
         else:
             signal = pickle.dumps(('connected', session, session_id, None))
             self.bots[session_id] = (bot, session)
             self.bots_event.set()
+            self.manager.record('create', timestamp)
         with self.connection_lock:
             self.connection.send(signal)
 
     def delete(self, session_id: str):
+        timestamp = time.monotonic()
         bot, session = self.bots.pop(session_id, (None, None))
         if bot:
             self.manager.shutdown_bot(bot, leave=True)
             signal = pickle.dumps(('deleted', session, session_id, None))
+            self.manager.record('delete', timestamp)
         else:
             signal = pickle.dumps(('deleted', None, session_id, Errors.NO_BOT))
+            self.manager.record('delete', timestamp, failed=True)
         with self.connection_lock:
             self.connection.send(signal)
 
 
 class BotsManager:
 
+    load_interval: float = 1
+    compact_interval: float = 300
+
     disconnects: deque[tuple[str, tuple[Bot, dict[str, Any]], bool]]
     bots: dict[str, tuple[Bot, dict[str, Any]]]
+    latencies: dict[str, list[float]]
+    failures: dict[str, int]
     exceptions: list[BaseException]
 
     def __init__(self, server_address: tuple[str, int], extractor_address: tuple[str, int]):
@@ -80,12 +94,21 @@ class BotsManager:
         self.extractor_address = extractor_address
         self.disconnects = deque()
         self.bots = {}
+        self.snapshots = SnapshotTracker(self.compact_interval)
         self.exceptions = []
         self.running = False
 
+        self.loop_lag = 0.0
+        self.load_timestamp = time.monotonic()
+        self.cpu_timestamp = time.process_time()
+        self.latencies = {'create': [], 'delete': []}
+        self.failures = {'create': 0, 'delete': 0}
+        self.stats_lock = threading.Lock()
+
         self.bots_event = threading.Event()
         self.connection_lock = threading.RLock()
         self.connection = ConnectionHandler(socket.create_connection(server_address))
+        self.connection.send(pickle.dumps(('started', os.getpid(), None, None)))
         self.sentinel_selector = selectors.DefaultSelector()
         self.commands_selector = selectors.DefaultSelector()
         self.commands_selector.register(self.connection.sock, selectors.EVENT_READ)
@@ -130,10 +153,67 @@ class BotsManager:
                 self.connection.send(signal)
 
     def update_sessions(self):
+        timestamp = time.monotonic()
+        session_ids = []
+        for session_id, (bot, session) in yield_from(self.bots):
+            session_ids.append(session_id)
+            operations, snapshot = self.snapshots.collect(
+                session_id, session['bot'], bot.profile.oplog, timestamp)
+            if operations:
+                signal = pickle.dumps(('patch', (session['bot']['user_id'], operations), session_id, None))
+                with self.connection_lock:
+                    self.connection.send(signal)
+            if snapshot:
+                signal = pickle.dumps(('update', session, session_id, None))
+                with self.connection_lock:
+                    self.connection.send(signal)
+        self.snapshots.retain(session_ids)
+
+        signal = pickle.dumps(('heartbeat', None, None, None))
+        with self.connection_lock:
+            self.connection.send(signal)
+
+    def collect_load(self):
+        timestamp = time.monotonic()
+        cpu_timestamp = time.process_time()
+        elapsed = max(timestamp - self.load_timestamp, 1e-6)
+        messages_count = 0
         for session_id, (bot, session) in yield_from(self.bots):
-            signal = pickle.dumps(('update', session, session_id, None))
+            messages_count += bot.room.messages_count
+            bot.room.messages_count = 0
+        load = {
+            'loop_lag': self.loop_lag,
+            'cpu': (cpu_timestamp - self.cpu_timestamp) / elapsed,
+            'messages_rate': messages_count / elapsed,
+            'threads': threading.active_count()}
+        self.loop_lag = 0.0
+        self.load_timestamp = timestamp
+        self.cpu_timestamp = cpu_timestamp
+
+        return load
+
+    def record(self, command: str, timestamp: float, failed: bool = False):
+        with self.stats_lock:
+            self.latencies[command].append(time.monotonic() - timestamp)
+            if failed:
+                self.failures[command] += 1
+
+    def collect_stats(self):
+        with self.stats_lock:
+            stats = {command: (durations, self.failures[command])
+                     for command, durations in self.latencies.items()}
+            self.latencies = {command: [] for command in stats}
+            self.failures = dict.fromkeys(stats, 0)
+
+        return stats
+
+    def report_load(self):
+        if time.monotonic() - self.load_timestamp > self.load_interval:
+            load_signal = pickle.dumps(('load', self.collect_load(), None, None))
+            stats_signal = pickle.dumps(('stats', self.collect_stats(), None, None))
             with self.connection_lock:
-                self.connection.send(signal)
+                self.connection.send(load_signal)
+                self.connection.send(stats_signal)
 
     def send_signals(self):
         update_timestamp = 0.0
@@ -171,10 +251,11 @@ class BotsManager:
     def run_bots(self):
         if not self.bots:
             self.bots_event.clear()
-            self.bots_event.wait()
-            if not self.running:
+            self.bots_event.wait(timeout=self.load_interval)
+            if not self.running or not self.bots:
                 return
         ready = self.sentinel_selector.select(timeout=0.1)
+        timestamp = time.monotonic()
         if ready:
             for key, events in ready:
                 session_id = key.data[0]
@@ -183,6 +264,7 @@ class BotsManager:
                     self.run_bot_once(session_id, bot)
         for session_id, (bot, session) in yield_from(self.bots):
             self.run_bot_once(session_id, bot)
+        self.loop_lag = max(self.loop_lag, time.monotonic() - timestamp)
 
     def run(self):
         self.running = True
@@ -194,6 +276,7 @@ class BotsManager:
                 if self.exceptions:
                     raise self.exceptions[0]
                 self.run_bots()
+                self.report_load()
         except:
             with self.connection_lock:
                 self.connection.send(b'crashed')
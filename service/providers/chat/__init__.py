@@ -3,6 +3,9 @@ from typing import TYPE_CHECKING, Any, Optional
 
 import re
 import asyncio
+import hashlib
+
+from lamb.utils.cache import LRUCache, SingleFlight
 
 from bot.mods.chat import AsyncChatAPI
 from bot.mods.chat.exceptions import ChatHttpError
@@ -43,22 +46,80 @@ def check_room_info(room: dict[str, Any], user_name: str, user_tripcode: str, bo
             raise ChatRequestError('User with the same nickname as bot is in room')
 
 
+def user_key(full_user_name: str):
+    return hashlib.blake2b(full_user_name.encode(), digest_size=16).digest()
+
+
 class ChatProvider:
 
-    def __init__(self, timeout: Optional[float] = 30):
-        self.api = AsyncChatAPI(timeout=timeout)
+    sessions: LRUCache[bytes, AsyncChatAPI]
+    lounges: LRUCache[bytes, dict[str, Any]]
+    lookups: SingleFlight[bytes, dict[str, Any]]
+    tasks: set[asyncio.Future[Any]]
+
+    def __init__(self, timeout: Optional[float] = 30, session_ttl: float = 60,
+                 lounge_ttl: float = 10, cache_size: int = 1024):
+        self.timeout = timeout
+        self.sessions = LRUCache(cache_size, session_ttl, on_evict=self.evict_session)
+        self.lounges = LRUCache(cache_size, lounge_ttl)
+        self.lookups = SingleFlight()
+        self.tasks = set()
 
     async def close(self):
-        await self.api.client.aclose()
+        self.sessions.clear()
+        self.lounges.clear()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
 
-    async def get_lounge_json(self, full_user_name: str):
+    def evict_session(self, key: bytes, api: AsyncChatAPI):
+        task = asyncio.ensure_future(self.close_session(api))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def close_session(self, api: AsyncChatAPI):
         try:
-            check_response_json(await self.api.login(full_user_name))
-            lounge = check_response_json(await self.api.get_lounge())
-            asyncio.create_task(self.api.logout())
-            return lounge
+            await api.logout()
+        except ChatHttpError:
+            pass
+        finally:
+            await api.client.aclose()
+
+    async def login(self, key: bytes, full_user_name: str):
+        api = self.sessions.get(key)
+        if api is not None:
+            return api, True
+        api = AsyncChatAPI(timeout=self.timeout)
+        try:
+            check_response_json(await api.login(full_user_name))
+        except BaseException:
+            await api.client.aclose()
+            raise
+        self.sessions.set(key, api)
+        return api, False
+
+    async def fetch_lounge(self, key: bytes, full_user_name: str):
+        try:
+            api, reused = await self.login(key, full_user_name)
+            try:
+                lounge = check_response_json(await api.get_lounge())
+            except (ChatRequestError, ValueError):
+                if not reused:
+                    raise
+                if self.sessions.pop(key) is api:
+                    self.evict_session(key, api)
+                api, reused = await self.login(key, full_user_name)
+                lounge = check_response_json(await api.get_lounge())
         except ChatHttpError:
             raise ChatApiNotResponding()
+        self.lounges.set(key, lounge)
+        return lounge
+
+    async def get_lounge_json(self, full_user_name: str):
+        self.sessions.expire()
+        key = user_key(full_user_name)
+        lounge = self.lounges.get(key)
+        if lounge is None:
+            lounge = await self.lookups.run(key, lambda: self.fetch_lounge(key, full_user_name))
+        return lounge
 
     async def get_user_info(self, full_user_name: str, bot_name: str,
                             room_id: str, hidden: bool = False) -> tuple[str, str]:
@@ -66,8 +127,12 @@ class ChatProvider:
         profile = lounge['profile']
         room_name = '[hidden]'
         if not hidden:
-            room = get_user_room(lounge['rooms'], room_id)
-            check_room_info(room, profile['name'], profile['tripcode'], bot_name)
+            try:
+                room = get_user_room(lounge['rooms'], room_id)
+                check_room_info(room, profile['name'], profile['tripcode'], bot_name)
+            except ChatRequestError:
+                self.lounges.pop(user_key(full_user_name))
+                raise
             room_name = room['name']
 
         return profile['tripcode'], room_name
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Optional
+
+import asyncio
+from collections import OrderedDict, deque
+
+from ..logging.logger import logger
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from lamb.utils.metrics import Registry
+
+
+CAPACITY_CHANNEL = 'balancers:capacity'
+
+
+class Waiter:
+
+    def __init__(self, session_id: str, user: str):
+        self.session_id = session_id
+        self.user = user
+        self.future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+
+class CreateQueue:
+
+    users: OrderedDict[str, deque[Waiter]]
+    waiters: dict[str, Waiter]
+
+    def __init__(self, redis: Redis, metrics: Registry, max_size: int, max_wait: float,
+                 poll_interval: float = 1):
+        self.redis = redis
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.users = OrderedDict()
+        self.waiters = {}
+
+        self.wait_latency = metrics.histogram(
+            'lamb_create_queue_seconds', 'Time creates waited for balancer capacity', ('result',))
+        metrics.gauge('lamb_create_queue', 'Creates waiting for balancer capacity',
+                      function=lambda: [((), len(self.waiters))])
+
+    def __len__(self):
+        return len(self.waiters)
+
+    async def init(self):
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(CAPACITY_CHANNEL)
+        self.listener = asyncio.ensure_future(self.listen())
+        self.poller = asyncio.ensure_future(self.poll())
+
+    async def close(self):
+        self.listener.cancel()
+        self.poller.cancel()
+        await asyncio.gather(self.listener, self.poller, return_exceptions=True)
+        await self.pubsub.aclose()  # type: ignore
+        for waiter in self.waiters.values():
+            waiter.future.cancel()
+
+    async def listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1)
+                continue
+            if message and message['type'] == 'message':
+                self.notify()
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.notify()
+
+    def position(self, session_id: str) -> Optional[int]:
+        waiter = self.waiters.get(session_id)
+        if waiter is None:
+            return None
+        index = self.users[waiter.user].index(waiter)
+        position = index + 1
+        before = True
+        for user, waiters in self.users.items():
+            if user == waiter.user:
+                before = False
+                continue
+            position += min(len(waiters), index + 1 if before else index)
+        return position
+
+    def notify(self):
+        while self.users:
+            user, waiters = self.users.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                self.users[user] = waiters
+            del self.waiters[waiter.session_id]
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+                return
+
+    def remove(self, waiter: Waiter):
+        if self.waiters.get(waiter.session_id) is not waiter:
+            return
+        del self.waiters[waiter.session_id]
+        waiters = self.users[waiter.user]
+        waiters.remove(waiter)
+        if not waiters:
+            del self.users[waiter.user]
+
+    async def wait(self, session_id: str, user: str, deadline: float, front: bool = False):
+        loop = asyncio.get_running_loop()
+        timeout = deadline - loop.time()
+        if timeout <= 0 or (not front and len(self.waiters) >= self.max_size):
+            self.wait_latency.observe(0, 'rejected')
+            return False
+        waiter = Waiter(session_id, user)
+        self.waiters[session_id] = waiter
+        waiters = self.users.get(user)
+        if waiters is None:
+            waiters = self.users[user] = deque()
+            if front:
+                self.users.move_to_end(user, last=False)
+        if front:
+            waiters.appendleft(waiter)
+        else:
+            waiters.append(waiter)
+
+        timestamp = loop.time()
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.notify()
+            if not isinstance(e, asyncio.TimeoutError):
+                raise
+            self.wait_latency.observe(loop.time() - timestamp, 'expired')
+            return False
+        finally:
+            self.remove(waiter)
+        self.wait_latency.observe(loop.time() - timestamp, 'admitted')
+        return True
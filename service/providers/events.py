@@ -0,0 +1,164 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Iterable
+
+import copy
+import json
+import asyncio
+
+from lamb.utils.cache import SingleFlight
+from lamb.utils.oplog import Operation, apply_operations
+
+from ..logging.logger import logger
+
+if TYPE_CHECKING:
+    from redis.asyncio.client import PubSub
+    from .rd import RedisProvider
+
+
+CHANNEL_PREFIX = 'sessions:events:'
+
+
+def events_channel(session_id: str):
+    return f'{CHANNEL_PREFIX}{session_id}'
+
+
+def json_pointer(path: Iterable[str]):
+    return ''.join('/' + str(key).replace('~', '~0').replace('/', '~1') for key in path)
+
+
+def diff_documents(old: dict[str, Any], new: dict[str, Any], path: tuple[str, ...] = ()):
+    operations = []
+    for key in old.keys() - new.keys():
+        operations.append({'op': 'remove', 'path': json_pointer(path + (key,))})
+    for key, value in new.items():
+        if key not in old:
+            operations.append({'op': 'add', 'path': json_pointer(path + (key,)), 'value': value})
+        elif old[key] != value:
+            if isinstance(old[key], dict) and isinstance(value, dict):
+                operations.extend(diff_documents(old[key], value, path + (key,)))
+            else:
+                operations.append({'op': 'replace', 'path': json_pointer(path + (key,)), 'value': value})
+    return operations
+
+
+def patch_operations(operations: Iterable[Operation]):
+    patch = []
+    for name, column, path, value in operations:
+        if name == 'set':
+            patch.append({'op': 'add', 'path': json_pointer((column, *path)), 'value': value})
+        else:
+            patch.append({'op': 'remove', 'path': json_pointer((column, *path))})
+    return patch
+
+
+class SessionEvents:
+
+    queue_size: int = 64
+
+    subscribers: dict[str, set[asyncio.Queue[dict[str, Any]]]]
+    states: dict[str, dict[str, Any] | None]
+    joins: SingleFlight[str, None]
+
+    def __init__(self, redis: RedisProvider):
+        self.redis = redis
+        self.subscribers = {}
+        self.states = {}
+        self.joins = SingleFlight()
+        self.subscribed = asyncio.Event()
+
+    async def init(self):
+        self.pubsub: PubSub = self.redis.redis.pubsub(ignore_subscribe_messages=True)
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def close(self):
+        self.reader.cancel()
+        await asyncio.gather(self.reader, return_exceptions=True)
+        await self.pubsub.aclose()  # type: ignore
+
+    async def read(self):
+        while True:
+            if not self.subscribers:
+                self.subscribed.clear()
+                await self.subscribed.wait()
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1)
+                await self.resync()
+                continue
+            if message and message['type'] == 'message':
+                try:
+                    self.dispatch(message['channel'][len(CHANNEL_PREFIX):], json.loads(message['data']))
+                except Exception as e:
+                    logger.exception(e)
+
+    async def resync(self):
+        for session_id in list(self.subscribers):
+            session_list = await self.redis.get_session_json(session_id, '$.bot')
+            self.publish(session_id, {'type': 'update', 'bot': session_list[0]}
+                         if session_list else {'type': 'closed'})
+
+    def dispatch(self, session_id: str, event: dict[str, Any]):
+        if session_id not in self.subscribers:
+            return
+        self.publish(session_id, event)
+
+    def publish(self, session_id: str, event: dict[str, Any]):
+        state = self.states.get(session_id)
+        if event['type'] == 'update':
+            self.states[session_id] = event['bot']
+            if state is None:
+                return self.broadcast(session_id, {'type': 'resync'})
+            operations = diff_documents(state, event['bot'])
+        elif event['type'] == 'patch':
+            if state is not None:
+                apply_operations(state, event['operations'])
+            operations = patch_operations(event['operations'])
+        else:
+            self.states[session_id] = None
+            return self.broadcast(session_id, {'type': 'closed'})
+        if operations:
+            self.broadcast(session_id, {'type': 'patch', 'operations': operations})
+
+    def broadcast(self, session_id: str, event: dict[str, Any]):
+        for queue in self.subscribers.get(session_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'type': 'resync'})
+
+    async def join(self, session_id: str):
+        await self.pubsub.subscribe(events_channel(session_id))
+        session_list = await self.redis.get_session_json(session_id, '$.bot')
+        if session_id not in self.subscribers:
+            await self.pubsub.unsubscribe(events_channel(session_id))
+            return
+        self.states[session_id] = copy.deepcopy(session_list[0]) if session_list else None
+
+    async def subscribe(self, session_id: str):
+        queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(session_id, set()).add(queue)
+        self.subscribed.set()
+        try:
+            if session_id not in self.states:
+                await self.joins.run(session_id, lambda: self.join(session_id))
+        except BaseException:
+            await self.unsubscribe(session_id, queue)
+            raise
+
+        return queue
+
+    async def unsubscribe(self, session_id: str, queue: asyncio.Queue[dict[str, Any]]):
+        subscribers = self.subscribers.get(session_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self.subscribers[session_id]
+            self.states.pop(session_id, None)
+            await self.pubsub.unsubscribe(events_channel(session_id))
@@ -0,0 +1,63 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable, TypeVar
+
+import sys
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from lamb.utils.cryptography import hash_passcode, verify_passcode
+
+from ..exceptions import LambServiceException
+
+if TYPE_CHECKING:
+    from lamb.utils.metrics import Registry
+
+
+T = TypeVar('T')
+
+
+class HasherOverloaded(LambServiceException):
+
+    extra = {'status_code': 503,
+             'message': 'Service is busy, try again later'}
+
+
+class PasscodeHasher:
+
+    def __init__(self, metrics: Registry, workers_count: int, max_pending: int):
+        self.workers_count = max(workers_count, 1)
+        self.max_pending = max(max_pending, self.workers_count)
+        self.pending = 0
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers_count, mp_context=multiprocessing.get_context('spawn'))
+
+        self.latency = metrics.histogram(
+            'lamb_hasher_seconds', 'Passcode hashing latency including queueing', ('operation',))
+        self.rejected = metrics.counter(
+            'lamb_hasher_rejected_total', 'Passcode hashing requests rejected by admission control')
+        metrics.gauge('lamb_hasher_queue', 'Passcode hashing requests queued or running',
+                      function=lambda: [((), self.pending)])
+
+    def close(self):
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            self.executor.shutdown(wait=False)
+
+    async def run(self, operation: str, func: Callable[..., T], *args: Any) -> T:
+        if self.pending >= self.max_pending:
+            self.rejected.inc()
+            raise HasherOverloaded()
+        self.pending += 1
+        try:
+            with self.latency.time(operation):
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, passcode: str) -> tuple[str, str]:
+        return await self.run('hash', hash_passcode, passcode)
+
+    async def verify(self, passcode: str, hashed_passcode: str) -> bool:
+        return await self.run('verify', verify_passcode, passcode, hashed_passcode)
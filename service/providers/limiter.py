@@ -0,0 +1,131 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypeVar
+
+import math
+import time
+import asyncio
+
+from ..exceptions import LambServiceException
+from ..logging.logger import logger
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from lamb.utils.metrics import Registry
+
+
+T = TypeVar('T')
+
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+local wait = 0
+local limited = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local capacity = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'timestamp')
+    local available = tonumber(bucket[1]) or capacity
+    local timestamp = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - timestamp) * rate)
+    tokens[i] = available
+    if available < 1 and (1 - available) / rate > wait then
+        wait = (1 - available) / rate
+        limited = i
+    end
+end
+if limited > 0 then
+    return {0, math.ceil(wait * 1000), limited}
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local capacity = tonumber(ARGV[i * 2])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'timestamp', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return {1, 0, 0}
+"""
+
+
+class RateLimited(LambServiceException):
+
+    extra = {'status_code': 429,
+             'message': 'Too many requests, try again later'}
+
+
+class CreateAdmission:
+
+    prefix: str = 'ratelimit:create'
+
+    def __init__(self, redis: Redis, metrics: Registry, limits: dict[str, tuple[float, float]],
+                 concurrency: int, max_pending: int):
+        self.redis = redis
+        self.limits = limits
+        self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.concurrency = max(concurrency, 1)
+        self.max_pending = max(max_pending, 0)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.pending = 0
+        self.running = 0
+        self.duration = 1.0
+
+        self.rejected = metrics.counter(
+            'lamb_create_rejected_total', 'Bot creations rejected at admission', ('reason',))
+        metrics.gauge('lamb_create_admission', 'Bot creations admitted by state', ('state',),
+                      function=lambda: [(('running',), self.running),
+                                        (('waiting',), self.pending - self.running)])
+
+    def eta(self):
+        waiting = max(self.pending - self.concurrency + 1, 1)
+        return math.ceil(waiting / self.concurrency * self.duration)
+
+    async def limit(self, **scopes: Optional[str]):
+        names: list[str] = []
+        keys: list[str] = []
+        args: list[float] = []
+        for name, (rate, capacity) in self.limits.items():
+            if name == 'global':
+                keys.append(f'{self.prefix}:global')
+            elif scopes.get(name):
+                keys.append(f'{self.prefix}:{name}:{scopes[name]}')
+            else:
+                continue
+            names.append(name)
+            args.extend((rate, capacity))
+        if not keys:
+            return
+        try:
+            allowed, wait, limited = await self.script(keys=keys, args=args)
+        except Exception as e:
+            logger.exception(e)
+            return
+        if not allowed:
+            self.rejected.inc(names[int(limited) - 1])
+            raise RateLimited(retry_after=max(math.ceil(int(wait) / 1000), 1))
+
+    def check(self):
+        if self.pending >= self.concurrency + self.max_pending:
+            self.rejected.inc('queue')
+            raise RateLimited(retry_after=self.eta())
+
+    async def admit(self, **scopes: Optional[str]):
+        self.check()
+        await self.limit(**scopes)
+        self.check()
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    async def run(self, func: Callable[[], Awaitable[T]]) -> T:
+        try:
+            async with self.semaphore:
+                self.running += 1
+                timestamp = time.monotonic()
+                try:
+                    return await func()
+                finally:
+                    self.running -= 1
+                    self.duration += (time.monotonic() - timestamp - self.duration) * 0.1
+        finally:
+            self.release()
@@ -1,49 +1,104 @@
-import asyncpg
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any
+
+import json
 
-from lamb.utils.cryptography import hash_passcode
+import asyncpg
 
 from ..models import User, Bot
 
+if TYPE_CHECKING:
+    from asyncpg.prepared_stmt import PreparedStatement
+    from .hasher import PasscodeHasher
+
+
+BOT_COLUMNS = ('name', 'tripcode', 'passcode', 'icon', 'language', 'command_prefix',
+               'whitelist', 'blacklist', 'groups', 'user_id')
+
+UPSERT_BOT = """
+    b AS (
+        INSERT INTO bots (name, passcode, user_id)
+        SELECT $3, $4, u.id FROM u
+        ON CONFLICT (user_id) DO UPDATE
+            SET name = EXCLUDED.name, passcode = EXCLUDED.passcode
+        RETURNING name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id
+    )
+    SELECT u.id AS user_id_, u.name AS user_name_, u.tripcode AS user_tripcode_, b.*
+    FROM u JOIN b ON b.user_id = u.id
+    """
+
+STATEMENTS = {
+    'upsert_existing_user_bot': """
+        WITH u AS (
+            SELECT id, name, tripcode FROM users
+            WHERE name = $1 AND tripcode = $2
+            ORDER BY id
+            LIMIT 1
+        ),
+        """ + UPSERT_BOT,
+    'upsert_new_user_bot': """
+        WITH u AS (
+            INSERT INTO users (name, tripcode, passcode, salt)
+            VALUES ($1, $2, $5, $6)
+            RETURNING id, name, tripcode
+        ),
+        """ + UPSERT_BOT}
+
+
+class Connection(asyncpg.Connection):
+
+    statements: dict[str, PreparedStatement]
+
+    async def prepare_statements(self):
+        self.statements = {name: await self.prepare(query) for name, query in STATEMENTS.items()}
+
+
+def encode_jsonb(value: Any) -> bytes:
+    return b'\x01' + json.dumps(value).encode()
+
+
+def decode_jsonb(data: bytes) -> Any:
+    return json.loads(data[1:])
+
+
+async def set_json_codecs(conn: asyncpg.Connection):
+    await conn.set_type_codec('jsonb', encoder=encode_jsonb, decoder=decode_jsonb,
+                              schema='pg_catalog', format='binary')
+
+
+async def init_connection(conn: Connection):
+    await set_json_codecs(conn)
+    await conn.prepare_statements()
+
+
+def split_user_bot(record: asyncpg.Record) -> tuple[User, Bot]:
+    user = User(id=record['user_id_'], name=record['user_name_'],  # type: ignore
+                tripcode=record['user_tripcode_'])
+    bot = Bot({column: record[column] for column in BOT_COLUMNS})  # type: ignore
+    return user, bot
+
 
 class PostgresProvider:
 
+    def __init__(self, hasher: PasscodeHasher):
+        self.hasher = hasher
+
     async def init(self, **kwargs):
-        self.pool = asyncpg.create_pool(**kwargs)
+        self.pool = asyncpg.create_pool(connection_class=Connection, init=init_connection, **kwargs)
         await self.pool._async__init__()
 
     async def close(self):
         await self.pool.close()
 
-    async def get_or_create_user(self, name: str, tripcode: str, passcode: str):
-        async with self.pool.acquire() as conn:
-            user = await conn.fetchrow("""
-                SELECT id, name, tripcode FROM users
-                WHERE name = $1 AND tripcode = $2
-                """, name, tripcode)
-            if not user:
-                hashed_passcode, salt = hash_passcode(passcode)
-                user = await conn.fetchrow("""
-                    INSERT INTO users (name, tripcode, passcode, salt)
-                    VALUES ($1, $2, $3, $4)
-                    RETURNING id, name, tripcode
-                    """, name, tripcode, hashed_passcode, salt)
-
-        return User(user)  # type: ignore
-
-    async def get_or_create_bot(self, name: str, passcode: str, user_id: str):
+    async def upsert_user_bot(self, user_name: str, user_tripcode: str, user_passcode: str,
+                              bot_name: str, bot_passcode: str):
         async with self.pool.acquire() as conn:
-            bot = await conn.fetchrow("""
-                WITH ins AS(
-                    INSERT INTO bots (name, passcode, user_id)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (user_id) DO UPDATE
-                        SET name = $1, passcode = $2
-                    RETURNING name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id
-                )
-                SELECT name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id FROM ins
-                UNION
-                SELECT name, tripcode, passcode, icon, language, command_prefix, whitelist, blacklist, groups, user_id FROM bots
-                WHERE user_id = $3
-                """, name, passcode, user_id)
-
-        return Bot(bot)  # type: ignore
+            record = await conn.statements['upsert_existing_user_bot'].fetchrow(
+                user_name, user_tripcode, bot_name, bot_passcode)
+        if record is None:
+            hashed_passcode, salt = await self.hasher.hash(user_passcode)
+            async with self.pool.acquire() as conn:
+                record = await conn.statements['upsert_new_user_bot'].fetchrow(
+                    user_name, user_tripcode, bot_name, bot_passcode, hashed_passcode, salt)
+
+        return split_user_bot(record)
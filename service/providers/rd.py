@@ -1,35 +1,163 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Optional
+
+import json
+import asyncio
 
 import redis.asyncio as redis
 
+from lamb.utils.cache import LRUCache, SingleFlight
+from lamb.utils.metrics import Registry
+
+from ..logging.logger import logger
+
 if TYPE_CHECKING:
     from datetime import timedelta
 
 
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+
 class RedisProvider:
 
-    def __init__(self, **kwargs):
+    tracking_prefix: str = 'session:'
+
+    cache: LRUCache[str, dict[str, Any]]
+    fetches: SingleFlight[tuple[str, str], Any]
+    fetching: dict[str, object]
+
+    def __init__(self, metrics: Optional[Registry] = None, cache_size: int = 0, **kwargs):
         self.redis = redis.Redis(**kwargs)
+        self.cache_size = cache_size
+        self.cache = LRUCache(cache_size)
+        self.fetches = SingleFlight()
+        self.fetching = {}
+        self.tracking = False
+        self.tracker: asyncio.Future[None] | None = None
+        if metrics is None:
+            metrics = Registry()
+        self.cache_requests = metrics.counter(
+            'lamb_session_cache_requests_total', 'Session reads by client-side cache result', ('result',))
+        self.cache_invalidations = metrics.counter(
+            'lamb_session_cache_invalidations_total', 'Session keys invalidated by Redis tracking')
+        metrics.gauge('lamb_session_cache_entries', 'Sessions held in the client-side cache',
+                      function=lambda: [((), len(self.cache))])
+
+    async def init(self):
+        if self.cache_size > 0:
+            self.tracker = asyncio.ensure_future(self.track())
 
     async def close(self):
+        if self.tracker is not None:
+            self.tracker.cancel()
+            await asyncio.gather(self.tracker, return_exceptions=True)
         await self.redis.aclose()  # type: ignore
 
+    def make_connection(self) -> redis.Connection:
+        kwargs = self.redis.connection_pool.connection_kwargs
+        return redis.Connection(**{**kwargs, 'protocol': 2})
+
+    async def track(self):
+        while True:
+            try:
+                await self.listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(1)
+
+    async def listen(self):
+        listener = self.make_connection()
+        connection = self.make_connection()
+        watcher = reader = None
+        try:
+            await listener.connect()
+            await connection.connect()
+            await listener.send_command('CLIENT', 'ID')
+            client_id = await listener.read_response()
+            await listener.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+            await listener.read_response()
+            await connection.send_command(
+                'CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST', 'PREFIX', self.tracking_prefix)
+            await connection.read_response()
+            self.tracking = True
+
+            watcher = asyncio.ensure_future(connection.read_response())
+            reader = asyncio.ensure_future(self.read_invalidations(listener))
+            done, pending = await asyncio.wait((watcher, reader), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            self.tracking = False
+            self.cache.clear()
+            self.fetching.clear()
+            for task in (watcher, reader):
+                if task is not None:
+                    task.cancel()
+            await listener.disconnect()
+            await connection.disconnect()
+
+    async def read_invalidations(self, listener: redis.Connection):
+        while True:
+            response = await listener.read_response()
+            if not isinstance(response, list) or len(response) < 3 or response[0] != 'message':
+                continue
+            keys = response[2]
+            if keys is None:
+                self.cache.clear()
+                self.fetching.clear()
+                continue
+            for key in keys:
+                self.invalidate(key)
+            self.cache_invalidations.inc(amount=len(keys))
+
+    def invalidate(self, key: str):
+        self.cache.pop(key)
+        self.fetching.pop(key, None)
+
+    async def fetch_session_json(self, key: str, path: str):
+        token = self.fetching.setdefault(key, object())
+        value = await self.redis.json().get(key, path)
+        if self.fetching.get(key) is token:
+            del self.fetching[key]
+            if self.tracking:
+                self.cache.set(key, {**self.cache.get(key, {}, count=False), path: value})
+        return value
+
     async def check_session_exists(self, session_id: str):
         return bool(await self.redis.exists(f'session:{session_id}'))
 
     async def get_session_json(self, session_id: str, path: str = '$'):
-        return await self.redis.json().get(f'session:{session_id}', path)
+        key = f'session:{session_id}'
+        if not self.tracking:
+            return await self.redis.json().get(key, path)
+        paths = self.cache.get(key, {}, count=False)
+        if path in paths:
+            self.cache_requests.inc('hit')
+            return paths[path]
+        self.cache_requests.inc('miss')
+        return await self.fetches.run((key, path), lambda: self.fetch_session_json(key, path))
 
     async def create_session_json(self, session_id: str, ttl: int | timedelta, session: dict[str, Any]):
+        self.invalidate(f'session:{session_id}')
         await self.redis.json().set(f'session:{session_id}', '$', session)
         await self.redis.expire(f'session:{session_id}', ttl)
 
     async def update_session_json(self, session_id: str, data: dict[str, Any], path: str = '$'):
+        self.invalidate(f'session:{session_id}')
         return await self.redis.json().set(f'session:{session_id}', path, data)
 
     async def delete_session_json(self, session_id: str):
+        self.invalidate(f'session:{session_id}')
         return await self.redis.json().delete(f'session:{session_id}', path='$')
 
     async def set_session_ttl(self, session_id: str, ttl: int | timedelta):
         return await self.redis.expire(f'session:{session_id}', ttl)
+
+    async def set_create_status(self, session_id: str, status: dict[str, Any], ttl: int | timedelta):
+        return await self.redis.set(f'create:{session_id}', json.dumps(status), ex=ttl)
+
+    async def get_create_status(self, session_id: str) -> dict[str, Any] | None:
+        status = await self.redis.get(f'create:{session_id}')
+        return json.loads(status) if status else None
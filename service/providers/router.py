@@ -1,63 +1,67 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Any, Callable, Optional
+from typing import TYPE_CHECKING, Optional
 
-import uuid
 import asyncio
-import aio_pika
-from aio_pika import Message
-from aio_pika.exceptions import DeliveryError
-from pamqp.commands import Basic
 
 from ..errors import Errors
+from .create_queue import CAPACITY_CHANNEL
 
 if TYPE_CHECKING:
-    from asyncio import Future
-    from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractIncomingMessage
-    from aio_pika.message import ReturnedMessage
+    from lamb.utils.metrics import Registry
     from redis.asyncio import Redis
-
-
-class RPC:
-
-    futures: dict[str, tuple[Future, Callable[[Future[str], AbstractIncomingMessage], Any]]]
-
-    def __init__(self, channel: AbstractChannel, exchange: AbstractExchange):
-        self.channel = channel
-        self.exchange = exchange
-        self.futures = {}
-
-    async def init(self):
-        self.queue = await self.channel.declare_queue(exclusive=True)
-        await self.queue.bind(self.exchange)
-
-        self.channel.close_callbacks.add(self.on_close)
-        self.channel.return_callbacks.add(self.on_message_return)
-        await self.queue.consume(self.on_reply, no_ack=True)
-
-    async def on_close(self, channel: AbstractChannel, exc: Optional[BaseException] = None):
-        for future, callback in self.futures.values():
-            if not future.done():
-                future.set_exception(exc or asyncio.CancelledError)
-        self.futures.clear()
-
-    async def on_message_return(self, channel: AbstractChannel, message: ReturnedMessage):
-        if message.correlation_id in self.futures:
-            future, callback = self.futures.pop(message.correlation_id)
-            if not future.done():
-                future.set_exception(asyncio.CancelledError)
-
-    async def on_reply(self, message: AbstractIncomingMessage):
-        if message.correlation_id in self.futures:
-            future, callback = self.futures.pop(message.correlation_id)
-            await callback(future, message)
-
-    def create_future(self, callback: Callable[[Future[str], AbstractIncomingMessage], Any]) -> tuple[Future[str], str]:
-        correlation_id = str(uuid.uuid4())
-        future: asyncio.Future[str] = asyncio.Future()
-        self.futures[correlation_id] = (future, callback)
-        future.add_done_callback(lambda future: self.futures.pop(correlation_id, None))
-
-        return future, correlation_id
+    from .transport import BaseRouterTransport
+    from .create_queue import CreateQueue
+
+
+RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {'exists'}
+end
+local excluded = {}
+for i = 2, #ARGV do
+    excluded[ARGV[i]] = true
+end
+local top = redis.call('ZREVRANGE', KEYS[2], 0, #ARGV - 1, 'WITHSCORES')
+for i = 1, #top, 2 do
+    if not excluded[top[i]] then
+        if tonumber(top[i + 1]) <= 0 then
+            return {'full'}
+        end
+        redis.call('SET', KEYS[1], top[i], 'EX', ARGV[1])
+        redis.call('ZINCRBY', KEYS[2], -1, top[i])
+        return {'ok', top[i]}
+    end
+end
+return {'empty'}
+"""
+
+RELEASE_SCRIPT = """
+local queue_name = redis.call('GET', KEYS[1])
+if not queue_name or (#ARGV > 0 and queue_name ~= ARGV[1]) then
+    return false
+end
+redis.call('DEL', KEYS[1])
+if redis.call('ZSCORE', KEYS[2], queue_name) then
+    redis.call('ZINCRBY', KEYS[2], 1, queue_name)
+    redis.call('PUBLISH', KEYS[3], queue_name)
+end
+return queue_name
+"""
+
+CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PERSIST', KEYS[1])
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('ZINCRBY', KEYS[2], -1, ARGV[1])
+return 1
+"""
+
+RESERVE_ERRORS = {
+    'exists': Errors.ALREADY_CREATED,
+    'empty': Errors.NO_BALANCERS,
+    'full': Errors.NO_WORKERS}
 
 
 class RouterCommands:
@@ -65,42 +69,60 @@ class RouterCommands:
     def __init__(self, router: Router):
         self.router = router
         self.redis = router.redis
-        self.exchange = router.exchange
-        self.lock = asyncio.Lock()
-
-    async def create(self, session_id: str):
-        async with self.lock:
-            queue_name = await self.redis.get(f'balancers:{session_id}')
-            if queue_name:
-                return Errors.ALREADY_CREATED
-
-            response = await self.redis.zrange('balancers:queue', 0, 0, desc=True, withscores=True)
-            if not response:
-                return Errors.NO_BALANCERS
-
-            queue_name, workers_count = response[0]
-            if workers_count <= 0:
-                return Errors.NO_WORKERS
-
-            await self.redis.set(f'balancers:{session_id}', queue_name)
-            await self.redis.zincrby('balancers:queue', -1, queue_name)
-
-        future = await self.router.publish_message(f'create/{session_id}'.encode(), queue_name)
-        error = await future
-        if error:
-            async with self.lock:
-                await self.redis.getdel(f'balancers:{session_id}')
-                await self.redis.zincrby('balancers:queue', 1, queue_name)
+        self.reserve = self.redis.register_script(RESERVE_SCRIPT)
+        self.release = self.redis.register_script(RELEASE_SCRIPT)
+
+    async def create(self, session_id: str, user: Optional[str] = None):
+        keys = [f'balancers:{session_id}', 'balancers:queue', CAPACITY_CHANNEL]
+        queue = self.router.queue
+        excluded: list[str] = []
+        deadline = None
+        woken = False
+        attempt = 0
+        try:
+            while attempt <= self.router.retries:
+                status, *response = await self.reserve(keys=keys[:2], args=[self.router.reservation_ttl, *excluded])
+                if status == 'full' and queue is not None:
+                    if deadline is None:
+                        deadline = asyncio.get_running_loop().time() + queue.max_wait
+                    front, woken = woken, False
+                    if not await queue.wait(session_id, user or session_id, deadline, front=front):
+                        return Errors.NO_WORKERS
+                    woken = True
+                    continue
+                if status != 'ok':
+                    return RESERVE_ERRORS[status]
+                if woken and queue is not None:
+                    woken = False
+                    queue.notify()
+                queue_name = response[0]
+
+                future = await self.router.publish_message(f'create/{session_id}'.encode(), queue_name)
+                if future.cancelled():
+                    await self.release(keys=keys, args=[queue_name])
+                    excluded.append(queue_name)
+                    attempt += 1
+                    if attempt <= self.router.retries:
+                        self.router.retries_counter.inc('create')
+                    continue
+                try:
+                    error = await future
+                except BaseException:
+                    await self.release(keys=keys, args=[queue_name])
+                    raise
+                if error:
+                    await self.release(keys=keys, args=[queue_name])
+                return error
 
-            return error
+            return Errors.PUBLISH_ERROR
+        finally:
+            if woken and queue is not None:
+                queue.notify()
 
     async def delete(self, session_id: str):
-        async with self.lock:
-            queue_name = await self.redis.getdel(f'balancers:{session_id}')
-            if queue_name:
-                await self.redis.zincrby('balancers:queue', 1, queue_name)
-            else:
-                return Errors.NO_BOT
+        queue_name = await self.release(keys=[f'balancers:{session_id}', 'balancers:queue', CAPACITY_CHANNEL])
+        if not queue_name:
+            return Errors.NO_BOT
 
         future = await self.router.publish_message(f'delete/{session_id}'.encode(), queue_name)
         return await future
@@ -108,45 +130,47 @@ class RouterCommands:
 
 class Router:
 
-    def __init__(self, redis: Redis) -> None:
+    def __init__(self, redis: Redis, transport: BaseRouterTransport, metrics: Registry,
+                 timeout: float, retries: int, reservation_ttl: int,
+                 queue: Optional[CreateQueue] = None) -> None:
         self.redis = redis
+        self.transport = transport
+        self.queue = queue
+        self.timeout = timeout
+        self.retries = retries
+        self.reservation_ttl = reservation_ttl
+
+        self.latency = metrics.histogram('lamb_rpc_seconds', 'Balancer RPC latency', ('command',))
+        self.timeouts_counter = metrics.counter(
+            'lamb_rpc_timeouts_total', 'Balancer RPCs that missed their deadline', ('command',))
+        self.retries_counter = metrics.counter(
+            'lamb_rpc_retries_total', 'Balancer RPCs retried on another balancer', ('command',))
+        metrics.gauge('lamb_rpc_in_flight', 'Balancer RPCs waiting for a reply',
+                      function=lambda: [((), len(transport.rpc.futures))])
 
-    async def init(self, prefetch_count: int = 0, **kwargs):
-        self.connection = await aio_pika.connect(**kwargs)
-        self.channel = await self.connection.channel()
-        await self.channel.set_qos(prefetch_count=prefetch_count)
-
-        self.exchange = await self.channel.declare_exchange('balancers')
-        self.rpc = RPC(self.channel, self.exchange)
-        await self.rpc.init()
-
+    async def init(self):
+        await self.transport.init()
+        if self.queue is not None:
+            await self.queue.init()
         self.commands = RouterCommands(self)
 
     async def close(self):
-        await self.channel.close()
-        await self.connection.close()
-
-    async def command_callback(self, future: Future[str], message: AbstractIncomingMessage):
-        future.set_result(message.body.decode())
+        if self.queue is not None:
+            await self.queue.close()
+        await self.transport.close()
 
     async def publish_message(self, message: bytes, queue_name: str):
-        future, correlation_id = self.rpc.create_future(self.command_callback)
-        try:
-            confirm = await self.exchange.publish(
-                Message(message, correlation_id=correlation_id, reply_to=self.rpc.queue.name), queue_name)
-        except DeliveryError:
-            future.cancel()
-        else:
-            if not isinstance(confirm, Basic.Ack):
-                future.cancel()
-
-        return future
+        return await self.transport.publish(message, queue_name, self.timeout)
 
-    async def publish_command(self, command: str, session_id: str) -> str:
+    async def publish_command(self, command: str, session_id: str, **kwargs) -> str:
         command_func = getattr(self.commands, command, None)
         if not command_func:
             return Errors.NO_COMMAND
         try:
-            return await command_func(session_id)
+            with self.latency.time(command):
+                return await command_func(session_id, **kwargs)
+        except asyncio.TimeoutError:
+            self.timeouts_counter.inc(command)
+            return Errors.RPC_TIMEOUT
         except asyncio.CancelledError:
             return Errors.PUBLISH_ERROR
@@ -0,0 +1,25 @@
+from __future__ import annotations
+from typing import Type
+
+from .base import RPC, Request, BaseRouterTransport, BaseBalancerTransport
+
+__all__ = ['RPC', 'Request', 'BaseRouterTransport', 'BaseBalancerTransport',
+           'create_router_transport', 'create_balancer_transport']
+
+
+def import_transports(kind: str) -> tuple[Type[BaseRouterTransport], Type[BaseBalancerTransport]]:
+    if kind == 'amqp':
+        from .amqp import AMQPRouterTransport, AMQPBalancerTransport
+        return AMQPRouterTransport, AMQPBalancerTransport
+    if kind == 'redis':
+        from .streams import StreamRouterTransport, StreamBalancerTransport
+        return StreamRouterTransport, StreamBalancerTransport
+    raise ValueError(f'Unknown transport {kind}')
+
+
+def create_router_transport(kind: str, **kwargs) -> BaseRouterTransport:
+    return import_transports(kind)[0](**kwargs)
+
+
+def create_balancer_transport(kind: str, **kwargs) -> BaseBalancerTransport:
+    return import_transports(kind)[1](**kwargs)
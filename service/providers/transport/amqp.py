@@ -0,0 +1,106 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable, Awaitable, Optional
+
+import aio_pika
+from aio_pika import Message
+from aio_pika.exceptions import DeliveryError
+from pamqp.commands import Basic
+
+from .base import Request, BaseRouterTransport, BaseBalancerTransport
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+    from aio_pika.message import ReturnedMessage
+
+
+class AMQPRequest(Request):
+
+    def __init__(self, transport: AMQPBalancerTransport, message: AbstractIncomingMessage):
+        self.transport = transport
+        self.message = message
+        self.body = message.body
+
+    async def reply(self, body: bytes):
+        if self.message.reply_to is None:
+            return
+        await self.transport.exchange.publish(
+            Message(body, correlation_id=self.message.correlation_id), self.message.reply_to)
+        await self.message.ack()
+
+
+class AMQPRouterTransport(BaseRouterTransport):
+
+    def __init__(self, prefetch_count: int = 0, **kwargs):
+        super().__init__()
+        self.prefetch_count = prefetch_count
+        self.settings = kwargs
+
+    async def init(self):
+        self.connection = await aio_pika.connect(**self.settings)
+        self.channel = await self.connection.channel()
+        await self.channel.set_qos(prefetch_count=self.prefetch_count)
+
+        self.exchange = await self.channel.declare_exchange('balancers')
+        self.queue = await self.channel.declare_queue(exclusive=True)
+        await self.queue.bind(self.exchange)
+
+        self.channel.close_callbacks.add(self.on_close)
+        self.channel.return_callbacks.add(self.on_message_return)
+        await self.queue.consume(self.on_reply, no_ack=True)
+
+    async def close(self):
+        await self.channel.close()
+        await self.connection.close()
+        await super().close()
+
+    async def on_close(self, channel: AbstractChannel, exc: Optional[BaseException] = None):
+        self.rpc.fail(exc)
+
+    async def on_message_return(self, channel: AbstractChannel, message: ReturnedMessage):
+        if message.correlation_id:
+            self.rpc.cancel(message.correlation_id)
+
+    async def on_reply(self, message: AbstractIncomingMessage):
+        if message.correlation_id:
+            self.rpc.resolve(message.correlation_id, message.body)
+
+    async def publish(self, body: bytes, queue_name: str, timeout: float | None = None):
+        future, correlation_id = self.rpc.create_future(timeout)
+        try:
+            confirm = await self.exchange.publish(
+                Message(body, correlation_id=correlation_id, reply_to=self.queue.name), queue_name)
+        except DeliveryError:
+            future.cancel()
+        else:
+            if not isinstance(confirm, Basic.Ack):
+                future.cancel()
+
+        return future
+
+
+class AMQPBalancerTransport(BaseBalancerTransport):
+
+    def __init__(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+        self.settings = kwargs
+
+    async def init(self):
+        self.connection = await aio_pika.connect(**self.settings)
+        self.channel = await self.connection.channel()
+        await self.channel.set_qos(prefetch_count=self.prefetch_count)
+
+        self.exchange = await self.channel.declare_exchange('balancers')
+        self.queue = await self.channel.declare_queue(exclusive=True)
+        await self.queue.bind(self.exchange)
+        self.name = self.queue.name
+
+    async def close(self):
+        await self.channel.close()
+        await self.connection.close()
+
+    async def consume(self, callback: Callable[[Request], Awaitable[Any]]):
+        self.callback = callback
+        await self.queue.consume(self.on_message)
+
+    async def on_message(self, message: AbstractIncomingMessage):
+        await self.callback(AMQPRequest(self, message))
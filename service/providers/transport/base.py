@@ -0,0 +1,85 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable, Awaitable, Optional
+
+import uuid
+import asyncio
+
+if TYPE_CHECKING:
+    from asyncio import Future
+
+
+class RPC:
+
+    futures: dict[str, Future[str]]
+
+    def __init__(self):
+        self.futures = {}
+
+    def create_future(self, timeout: float | None = None) -> tuple[Future[str], str]:
+        correlation_id = str(uuid.uuid4())
+        future: asyncio.Future[str] = asyncio.Future()
+        self.futures[correlation_id] = future
+        future.add_done_callback(lambda future: self.futures.pop(correlation_id, None))
+        if timeout is not None:
+            handle = asyncio.get_running_loop().call_later(timeout, self.expire, correlation_id)
+            future.add_done_callback(lambda future: handle.cancel())
+
+        return future, correlation_id
+
+    def resolve(self, correlation_id: str, body: bytes):
+        future = self.futures.pop(correlation_id, None)
+        if future and not future.done():
+            future.set_result(body.decode())
+
+    def cancel(self, correlation_id: str):
+        future = self.futures.pop(correlation_id, None)
+        if future and not future.done():
+            future.cancel()
+
+    def expire(self, correlation_id: str):
+        future = self.futures.pop(correlation_id, None)
+        if future and not future.done():
+            future.set_exception(asyncio.TimeoutError())
+
+    def fail(self, exc: Optional[BaseException] = None):
+        for future in self.futures.values():
+            if not future.done():
+                future.set_exception(exc or asyncio.CancelledError())
+        self.futures.clear()
+
+
+class Request:
+
+    body: bytes
+
+    async def reply(self, body: bytes):
+        pass
+
+
+class BaseRouterTransport:
+
+    def __init__(self):
+        self.rpc = RPC()
+
+    async def init(self):
+        pass
+
+    async def close(self):
+        self.rpc.fail()
+
+    async def publish(self, body: bytes, queue_name: str, timeout: float | None = None):
+        pass
+
+
+class BaseBalancerTransport:
+
+    name: str
+
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def consume(self, callback: Callable[[Request], Awaitable[Any]]):
+        pass
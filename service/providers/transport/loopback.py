@@ -0,0 +1,62 @@
+from __future__ import annotations
+from typing import Any, Callable, Awaitable
+
+import uuid
+import asyncio
+
+from .base import RPC, Request, BaseRouterTransport, BaseBalancerTransport
+
+
+class LoopbackBroker:
+
+    consumers: dict[str, Callable[[Request], Awaitable[Any]]]
+
+    def __init__(self):
+        self.consumers = {}
+
+
+BROKER = LoopbackBroker()
+
+
+class LoopbackRequest(Request):
+
+    def __init__(self, rpc: RPC, correlation_id: str, body: bytes):
+        self.rpc = rpc
+        self.correlation_id = correlation_id
+        self.body = body
+
+    async def reply(self, body: bytes):
+        self.rpc.resolve(self.correlation_id, body)
+
+
+class LoopbackRouterTransport(BaseRouterTransport):
+
+    def __init__(self, broker: LoopbackBroker = BROKER, **kwargs):
+        super().__init__()
+        self.broker = broker
+        self.tasks: set[asyncio.Future[Any]] = set()
+
+    async def publish(self, body: bytes, queue_name: str, timeout: float | None = None):
+        future, correlation_id = self.rpc.create_future(timeout)
+        callback = self.broker.consumers.get(queue_name)
+        if callback is None:
+            future.cancel()
+        else:
+            task = asyncio.ensure_future(callback(LoopbackRequest(self.rpc, correlation_id, body)))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        return future
+
+
+class LoopbackBalancerTransport(BaseBalancerTransport):
+
+    def __init__(self, broker: LoopbackBroker = BROKER, **kwargs):
+        self.broker = broker
+        self.name = f'loopback.{uuid.uuid4().hex}'
+
+    async def close(self):
+        self.broker.consumers.pop(self.name, None)
+
+    async def consume(self, callback: Callable[[Request], Awaitable[Any]]):
+        self.broker.consumers[self.name] = callback
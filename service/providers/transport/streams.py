@@ -0,0 +1,132 @@
+from __future__ import annotations
+from typing import Any, Callable, Awaitable, Optional
+
+import uuid
+import asyncio
+
+import redis.asyncio as redis
+
+from ...logging.logger import logger
+from .base import Request, BaseRouterTransport, BaseBalancerTransport
+
+
+def create_client(**kwargs):
+    return redis.Redis(**{**kwargs, 'protocol': 2, 'decode_responses': False})
+
+
+class StreamRequest(Request):
+
+    def __init__(self, transport: StreamBalancerTransport, message_id: bytes, fields: dict[bytes, bytes]):
+        self.transport = transport
+        self.message_id = message_id
+        self.body = fields[b'body']
+        self.correlation_id = fields.get(b'correlation_id')
+        self.reply_to = fields.get(b'reply_to')
+
+    async def reply(self, body: bytes):
+        if self.reply_to is None:
+            return
+        transport = self.transport
+        pipeline = transport.redis.pipeline(transaction=False)
+        pipeline.xadd(self.reply_to, {'correlation_id': self.correlation_id, 'body': body},
+                      maxlen=transport.maxlen, approximate=True)
+        pipeline.xack(transport.stream, transport.group, self.message_id)
+        pipeline.xdel(transport.stream, self.message_id)
+        await pipeline.execute()
+
+
+class StreamRouterTransport(BaseRouterTransport):
+
+    block: int = 5000
+    count: int = 100
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.settings = kwargs
+
+    async def init(self):
+        self.redis = create_client(**self.settings)
+        self.reply_to = f'balancers:replies:{uuid.uuid4().hex}'
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def close(self):
+        self.reader.cancel()
+        await self.redis.delete(self.reply_to)
+        await self.redis.aclose()  # type: ignore
+        await super().close()
+
+    async def read(self):
+        last_id = b'0-0'
+        while True:
+            try:
+                response = await self.redis.xread({self.reply_to: last_id}, count=self.count, block=self.block)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1)
+                continue
+            message_ids = []
+            for stream, messages in response or ():
+                for message_id, fields in messages:
+                    message_ids.append(message_id)
+                    self.rpc.resolve(fields[b'correlation_id'].decode(), fields[b'body'])
+            if message_ids:
+                last_id = message_ids[-1]
+                await self.redis.xdel(self.reply_to, *message_ids)
+
+    async def publish(self, body: bytes, queue_name: str, timeout: float | None = None):
+        future, correlation_id = self.rpc.create_future(timeout)
+        message_id = await self.redis.xadd(
+            f'balancers:stream:{queue_name}',
+            {'body': body, 'correlation_id': correlation_id, 'reply_to': self.reply_to},
+            nomkstream=True)
+        if message_id is None:
+            future.cancel()
+
+        return future
+
+
+class StreamBalancerTransport(BaseBalancerTransport):
+
+    group: str = 'balancer'
+    block: int = 5000
+    count: int = 100
+    maxlen: int = 10000
+
+    def __init__(self, **kwargs):
+        self.settings = kwargs
+        self.tasks: set[asyncio.Future[Any]] = set()
+        self.consumer: Optional[asyncio.Future[None]] = None
+
+    async def init(self):
+        self.redis = create_client(**self.settings)
+        self.name = f'balancer.{uuid.uuid4().hex}'
+        self.stream = f'balancers:stream:{self.name}'
+        await self.redis.xgroup_create(self.stream, self.group, id='$', mkstream=True)
+
+    async def close(self):
+        if self.consumer:
+            self.consumer.cancel()
+        await self.redis.delete(self.stream)
+        await self.redis.aclose()  # type: ignore
+
+    async def consume(self, callback: Callable[[Request], Awaitable[Any]]):
+        self.consumer = asyncio.ensure_future(self.read(callback))
+
+    async def read(self, callback: Callable[[Request], Awaitable[Any]]):
+        while True:
+            try:
+                response = await self.redis.xreadgroup(
+                    self.group, self.name, {self.stream: '>'}, count=self.count, block=self.block)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1)
+                continue
+            for stream, messages in response or ():
+                for message_id, fields in messages:
+                    task = asyncio.ensure_future(callback(StreamRequest(self, message_id, fields)))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
@@ -0,0 +1,47 @@
+import time
+import asyncio
+
+from lamb.utils.cache import LRUCache, SingleFlight
+
+
+def test_lru_cache_eviction_order():
+    evicted = []
+    cache = LRUCache(2, on_evict=lambda key, value: evicted.append(key))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert evicted == ['b']
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.hits == 3 and cache.misses == 0
+
+
+def test_lru_cache_ttl():
+    evicted = []
+    cache = LRUCache(10, ttl=0.01, on_evict=lambda key, value: evicted.append(key))
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=60)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert evicted == ['a']
+    assert cache.misses == 1
+
+
+def test_single_flight_deduplicates_calls():
+    async def main():
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        results = await asyncio.gather(*(flights.run('key', fetch) for i in range(5)))
+        assert results == ['value'] * 5
+        assert len(calls) == 1
+        assert not flights.flights
+
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+from lamb.utils.cryptography import (
+    hash_passcode,
+    verify_passcode,
+    base64_sign_value,
+    validate_base64_signed,
+    Base64SignedValidator
+)
+
+
+def test_verify_passcode():
+    hashed_passcode, salt = hash_passcode('#passcode', iterations=1000)
+    assert verify_passcode('#passcode', hashed_passcode)
+    assert verify_passcode(b'#passcode', hashed_passcode)
+    assert not verify_passcode('#password', hashed_passcode)
+
+
+def test_verify_passcode_malformed_hash():
+    assert not verify_passcode('#passcode', '')
+    assert not verify_passcode('#passcode', 'sha256$many$salt$hash')
+    assert not verify_passcode('#passcode', 'unknown$1000$salt$hash')
+
+
+def test_validate_base64_signed():
+    value = base64_sign_value('session-id', 'session', 'secret', altchars=b'-_')
+    assert validate_base64_signed(value, 'session', 'secret', altchars=b'-_')
+    assert not validate_base64_signed(value, 'session', 'other', altchars=b'-_')
+    assert not validate_base64_signed(value[:-1], 'session', 'secret', altchars=b'-_')
+    assert not validate_base64_signed('session-id', 'session', 'secret', altchars=b'-_')
+
+
+def test_base64_signed_validator():
+    validator = Base64SignedValidator('session', 'secret', altchars=b'-_', maxsize=2)
+    value = base64_sign_value('session-id', 'session', 'secret', altchars=b'-_')
+    assert validator(value)
+    assert validator(value)
+    assert validator.validated.hits == 1
+    assert not validator(value + 'x')
+    assert value + 'x' not in validator.validated
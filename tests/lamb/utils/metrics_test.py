@@ -0,0 +1,52 @@
+import asyncio
+
+from lamb.utils.metrics import Registry, MetricsServer
+
+
+def test_registry_render():
+    registry = Registry()
+    counter = registry.counter('requests_total', 'Requests', ('method',))
+    registry.gauge('queue', 'Queue depth', function=lambda: [((), 3)])
+    histogram = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    counter.inc('get')
+    counter.inc('get', amount=2)
+    counter.inc('p"ost')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{method="get"} 3.0' in lines
+    assert 'requests_total{method="p\\"ost"} 1.0' in lines
+    assert 'queue 3.0' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1.0' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2.0' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3.0' in lines
+    assert 'latency_seconds_sum 5.55' in lines
+    assert 'latency_seconds_count 3.0' in lines
+
+
+def test_metrics_server():
+    async def main():
+        registry = Registry()
+        gauge = registry.gauge('collected', 'Collected value')
+
+        async def collect():
+            gauge.set(42)
+
+        registry.add_collector(collect)
+        server = MetricsServer(registry, ('127.0.0.1', 0))
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+        finally:
+            await server.close()
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert b'collected 42.0' in response
+
+    asyncio.run(main())
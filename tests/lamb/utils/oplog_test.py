@@ -0,0 +1,69 @@
+from lamb.utils.oplog import OperationLog, SnapshotTracker, compact, apply_operations
+
+
+def test_compact_keeps_last_operation_per_path():
+    operations = [
+        ('set', 'whitelist', ('a',), 1),
+        ('set', 'groups', ('dj', 'users', 'x'), {}),
+        ('delete', 'whitelist', ('a',), None),
+        ('delete', 'groups', ('dj',), None),
+        ('set', 'whitelist', ('b',), 2)]
+    assert compact(operations) == [
+        ('delete', 'whitelist', ('a',), None),
+        ('delete', 'groups', ('dj',), None),
+        ('set', 'whitelist', ('b',), 2)]
+
+
+def test_apply_operations():
+    document = {'whitelist': {'a': 1}, 'groups': {'dj': {'users': {}}}}
+    apply_operations(document, [
+        ('set', 'whitelist', ('b',), 2),
+        ('delete', 'whitelist', ('a',), None),
+        ('set', 'groups', ('dj', 'users', 'x'), {'permit': 'dj'}),
+        ('set', 'groups', ('missing', 'users', 'y'), {}),
+        ('set', 'blacklist', ('c',), 3)])
+    assert document == {
+        'whitelist': {'b': 2},
+        'groups': {'dj': {'users': {'x': {'permit': 'dj'}}}},
+        'blacklist': {'c': 3}}
+
+
+def test_operation_log_overflow():
+    oplog = OperationLog(maxlen=2)
+    oplog.set('whitelist', ('a',), 1)
+    oplog.set('whitelist', ('b',), 2)
+    oplog.delete('whitelist', ('a',))
+    assert oplog.drain() == ([], True)
+    oplog.set('whitelist', ('c',), 3)
+    assert oplog.drain() == ([('set', 'whitelist', ('c',), 3)], False)
+
+
+def test_snapshot_tracker_sends_removal_after_patch():
+    tracker = SnapshotTracker(compact_interval=300)
+    oplog = OperationLog()
+    bot = {'whitelist': {}}
+    assert tracker.collect('s1', bot, oplog, 0) == ([], True)
+
+    bot['whitelist']['a'] = 1
+    oplog.set('whitelist', ('a',), 1)
+    assert tracker.collect('s1', bot, oplog, 10) == ([('set', 'whitelist', ('a',), 1)], False)
+
+    del bot['whitelist']['a']
+    oplog.delete('whitelist', ('a',))
+    assert tracker.collect('s1', bot, oplog, 400) == ([('delete', 'whitelist', ('a',), None)], True)
+    assert tracker.collect('s1', bot, oplog, 800) == ([], False)
+
+
+def test_snapshot_tracker_overflow_sends_snapshot():
+    tracker = SnapshotTracker(compact_interval=300)
+    oplog = OperationLog(maxlen=1)
+    bot = {'whitelist': {}}
+    tracker.collect('s1', bot, oplog, 0)
+
+    bot['whitelist'].update(a=1, b=2)
+    oplog.set('whitelist', ('a',), 1)
+    oplog.set('whitelist', ('b',), 2)
+    assert tracker.collect('s1', bot, oplog, 10) == ([], True)
+
+    tracker.retain([])
+    assert not tracker.digests and not tracker.compacted
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from lamb.utils.pools import AsyncBasePool
+
+
+def create_pool(items):
+    pool = AsyncBasePool(len(items))
+    pool.queue.extend(items)
+    return pool
+
+
+def test_async_pool_fifo_waiters():
+    async def main():
+        pool = create_pool(['item'])
+        order = []
+
+        async def worker(n):
+            async with pool.get_item() as item:
+                order.append(n)
+                await asyncio.sleep(0)
+                return item
+
+        results = await asyncio.gather(*(worker(n) for n in range(5)))
+        assert results == ['item'] * 5
+        assert order == [0, 1, 2, 3, 4]
+        assert pool.waits_count == 4
+        assert not pool.waiters
+        assert list(pool.queue) == ['item']
+
+    asyncio.run(main())
+
+
+def test_async_pool_acquire_timeout():
+    async def main():
+        pool = create_pool(['item'])
+        item = await pool.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire(timeout=0.01)
+        assert pool.timeouts_count == 1
+        assert not pool.waiters
+        pool.release(item)
+        assert await pool.acquire(timeout=0.01) == 'item'
+
+    asyncio.run(main())
+
+
+def test_async_pool_cancelled_waiter_does_not_leak_item():
+    async def main():
+        pool = create_pool(['item'])
+        item = await pool.acquire()
+        task = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0)
+        pool.release(item)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert list(pool.queue) == ['item']
+        assert not pool.waiters
+
+    asyncio.run(main())
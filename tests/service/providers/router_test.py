@@ -0,0 +1,147 @@
+import asyncio
+
+from lamb.utils.metrics import Registry
+
+from service.errors import Errors
+from service.providers.router import Router, RESERVE_SCRIPT, RELEASE_SCRIPT
+from service.providers.create_queue import CreateQueue
+from service.providers.transport.loopback import (
+    LoopbackBroker,
+    LoopbackRouterTransport,
+    LoopbackBalancerTransport
+)
+
+
+class ReservationsRedis:
+
+    def __init__(self):
+        self.values = {}
+        self.queue = {}
+        self.failing = set()
+
+    def register_script(self, script):
+        return {RESERVE_SCRIPT: self.reserve, RELEASE_SCRIPT: self.release}[script]
+
+    async def reserve(self, keys, args):
+        ttl, *excluded = args
+        if keys[0] in self.failing:
+            raise ConnectionError()
+        if keys[0] in self.values:
+            return ['exists']
+        for name, score in sorted(self.queue.items(), key=lambda item: -item[1]):
+            if name in excluded:
+                continue
+            if score <= 0:
+                return ['full']
+            self.values[keys[0]] = name
+            self.queue[name] -= 1
+            return ['ok', name]
+        return ['empty']
+
+    async def release(self, keys, args):
+        name = self.values.get(keys[0])
+        if name is None or (args and name != args[0]):
+            return None
+        del self.values[keys[0]]
+        if name in self.queue:
+            self.queue[name] += 1
+        return name
+
+
+def run_create(reply, timeout=1.0):
+    async def main():
+        broker = LoopbackBroker()
+        redis = ReservationsRedis()
+        router = Router(redis, LoopbackRouterTransport(broker), Registry(), timeout, 0, 60)
+        await router.init()
+        balancer = LoopbackBalancerTransport(broker)
+        redis.queue[balancer.name] = 2
+
+        async def callback(request):
+            await reply(router, request)
+
+        await balancer.consume(callback)
+        try:
+            error = await router.publish_command('create', 'session')
+        finally:
+            await balancer.close()
+            await router.close()
+        return error, redis.values, redis.queue[balancer.name]
+
+    return asyncio.run(main())
+
+
+def test_create_keeps_reservation_on_success():
+    async def reply(router, request):
+        await request.reply(b'')
+
+    error, reservations, capacity = run_create(reply)
+    assert error == ''
+    assert list(reservations) == ['balancers:session']
+    assert capacity == 1
+
+
+def test_create_releases_reservation_on_error():
+    async def reply(router, request):
+        await request.reply(Errors.NO_WORKERS.encode())
+
+    assert run_create(reply) == (Errors.NO_WORKERS, {}, 2)
+
+
+def test_create_releases_reservation_on_deadline():
+    async def reply(router, request):
+        pass
+
+    assert run_create(reply, timeout=0.05) == (Errors.RPC_TIMEOUT, {}, 2)
+
+
+def test_create_releases_reservation_on_cancel():
+    async def reply(router, request):
+        router.transport.rpc.fail()
+
+    assert run_create(reply) == (Errors.PUBLISH_ERROR, {}, 2)
+
+
+def test_create_hands_wakeup_to_next_waiter_on_failure():
+    async def main():
+        broker = LoopbackBroker()
+        redis = ReservationsRedis()
+        router = Router(redis, LoopbackRouterTransport(broker), Registry(), 1.0, 0, 60)
+        await router.init()
+        router.queue = CreateQueue(redis, Registry(), 10, 1.0)
+        balancer = LoopbackBalancerTransport(broker)
+        redis.queue[balancer.name] = 0
+        await balancer.consume(lambda request: request.reply(b''))
+
+        first = asyncio.ensure_future(router.commands.create('first', 'user1'))
+        second = asyncio.ensure_future(router.commands.create('second', 'user2'))
+        await asyncio.sleep(0.01)
+        assert len(router.queue) == 2
+
+        redis.queue[balancer.name] = 1
+        redis.failing.add('balancers:first')
+        router.queue.notify()
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        assert isinstance(results[0], ConnectionError)
+        assert results[1] == ''
+        assert list(redis.values) == ['balancers:second']
+        await balancer.close()
+        await router.transport.close()
+
+    asyncio.run(main())
+
+
+def test_queue_hands_wakeup_to_next_waiter_on_cancel():
+    async def main():
+        queue = CreateQueue(None, Registry(), 10, 1.0)
+        deadline = asyncio.get_running_loop().time() + 1.0
+        first = asyncio.ensure_future(queue.wait('first', 'user1', deadline))
+        second = asyncio.ensure_future(queue.wait('second', 'user2', deadline))
+        await asyncio.sleep(0)
+        queue.notify()
+        first.cancel()
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        assert results[0] is True or results[1] is True
+        assert not queue.waiters and not queue.users
+
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('aio_pika')
+
+from aio_pika.exceptions import DeliveryError
+from pamqp.commands import Basic
+
+from service.providers.transport import amqp
+
+
+class FakeExchange:
+
+    def __init__(self, confirm=None):
+        self.confirm = confirm
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((message, routing_key))
+        if isinstance(self.confirm, Exception):
+            raise self.confirm
+        return self.confirm
+
+
+class FakeMessage:
+
+    def __init__(self, body, correlation_id=None, reply_to=None):
+        self.body = body
+        self.correlation_id = correlation_id
+        self.reply_to = reply_to
+        self.acked = False
+
+    async def ack(self):
+        self.acked = True
+
+
+def create_router(confirm):
+    router = amqp.AMQPRouterTransport()
+    router.exchange = FakeExchange(confirm)
+    router.queue = SimpleNamespace(name='replies')
+    return router
+
+
+def test_amqp_publish_and_reply():
+    async def main():
+        router = create_router(Basic.Ack())
+        future = await router.publish(b'create/session', 'balancer', timeout=1)
+        (message, routing_key), = router.exchange.published
+        assert routing_key == 'balancer'
+        assert message.body == b'create/session' and message.reply_to == 'replies'
+        assert not future.done()
+
+        await router.on_reply(FakeMessage(b'done', message.correlation_id))
+        assert await future == 'done'
+
+    asyncio.run(main())
+
+
+def test_amqp_unconfirmed_publish_cancels():
+    async def main():
+        router = create_router(Basic.Nack())
+        future = await router.publish(b'create/session', 'balancer', timeout=1)
+        assert future.cancelled()
+
+        router = create_router(DeliveryError(None, None))
+        future = await router.publish(b'create/session', 'balancer', timeout=1)
+        assert future.cancelled()
+
+    asyncio.run(main())
+
+
+def test_amqp_returned_and_closed_channel():
+    async def main():
+        router = create_router(Basic.Ack())
+        returned = await router.publish(b'create/session', 'balancer', timeout=1)
+        message = router.exchange.published[-1][0]
+        await router.on_message_return(None, FakeMessage(b'', message.correlation_id))
+        assert returned.cancelled()
+
+        pending = await router.publish(b'create/session', 'balancer', timeout=1)
+        await router.on_close(None, ConnectionError())
+        with pytest.raises(ConnectionError):
+            await pending
+
+    asyncio.run(main())
+
+
+def test_amqp_request_reply():
+    async def main():
+        balancer = amqp.AMQPBalancerTransport()
+        balancer.exchange = FakeExchange()
+        requests = []
+
+        async def callback(request):
+            requests.append(request)
+            await request.reply(b'done')
+
+        balancer.callback = callback
+        message = FakeMessage(b'create/session', 'id', 'replies')
+        await balancer.on_message(message)
+        assert requests[0].body == b'create/session'
+        (reply, routing_key), = balancer.exchange.published
+        assert routing_key == 'replies'
+        assert reply.body == b'done' and reply.correlation_id == 'id'
+        assert message.acked
+
+        message = FakeMessage(b'create/session')
+        await balancer.on_message(message)
+        assert len(balancer.exchange.published) == 1
+
+    asyncio.run(main())
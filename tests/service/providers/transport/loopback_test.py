@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from service.providers.transport.loopback import (
+    LoopbackBroker,
+    LoopbackRouterTransport,
+    LoopbackBalancerTransport
+)
+
+
+async def connect():
+    broker = LoopbackBroker()
+    router = LoopbackRouterTransport(broker)
+    balancer = LoopbackBalancerTransport(broker)
+    await router.init()
+    await balancer.init()
+    return router, balancer
+
+
+def test_loopback_round_trip():
+    async def main():
+        router, balancer = await connect()
+        bodies = []
+
+        async def callback(request):
+            bodies.append(request.body)
+            await request.reply(b'done')
+
+        await balancer.consume(callback)
+        future = await router.publish(b'create/session', balancer.name, timeout=1)
+        assert await future == 'done'
+        assert bodies == [b'create/session']
+        assert not router.rpc.futures
+
+    asyncio.run(main())
+
+
+def test_loopback_unknown_queue_cancels():
+    async def main():
+        router, balancer = await connect()
+        future = await router.publish(b'create/session', 'missing', timeout=1)
+        assert future.cancelled()
+
+        await balancer.consume(lambda request: request.reply(b''))
+        await balancer.close()
+        future = await router.publish(b'create/session', balancer.name, timeout=1)
+        assert future.cancelled()
+
+    asyncio.run(main())
+
+
+def test_loopback_timeout_and_close():
+    async def main():
+        router, balancer = await connect()
+
+        async def callback(request):
+            pass
+
+        await balancer.consume(callback)
+        future = await router.publish(b'create/session', balancer.name, timeout=0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await future
+
+        future = await router.publish(b'create/session', balancer.name)
+        await router.close()
+        with pytest.raises(asyncio.CancelledError):
+            await future
+
+    asyncio.run(main())
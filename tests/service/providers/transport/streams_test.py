@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('redis')
+
+from service.providers.transport import streams
+
+
+def message_index(message_id):
+    return int(message_id.split(b'-')[0])
+
+
+def stream_key(name):
+    return name.decode() if isinstance(name, bytes) else name
+
+
+class FakePipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    async def execute(self):
+        return [await getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class FakeStreams:
+
+    def __init__(self):
+        self.streams = {}
+        self.groups = {}
+        self.acked = []
+        self.counter = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def aclose(self):
+        pass
+
+    async def delete(self, name):
+        self.streams.pop(stream_key(name), None)
+
+    async def xgroup_create(self, name, group, id='$', mkstream=False):
+        self.groups[name] = len(self.streams.setdefault(name, []))
+
+    async def xadd(self, name, fields, nomkstream=False, maxlen=None, approximate=True):
+        name = stream_key(name)
+        if nomkstream and name not in self.streams:
+            return None
+        self.counter += 1
+        message_id = f'{self.counter}-0'.encode()
+        fields = {key.encode(): value if isinstance(value, bytes) else value.encode()
+                  for key, value in fields.items()}
+        self.streams.setdefault(name, []).append((message_id, fields))
+        return message_id
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        (name, _), = streams.items()
+        messages = self.streams[name][self.groups[name]:]
+        if not messages:
+            await asyncio.sleep(0.005)
+            return []
+        self.groups[name] += len(messages)
+        return [[name.encode(), messages]]
+
+    async def xread(self, streams, count=None, block=None):
+        (name, last_id), = streams.items()
+        messages = [message for message in self.streams.get(stream_key(name), ())
+                    if message_index(message[0]) > message_index(last_id)]
+        if not messages:
+            await asyncio.sleep(0.005)
+            return []
+        return [[name.encode(), messages]]
+
+    async def xack(self, name, group, *message_ids):
+        self.acked.extend(message_ids)
+
+    async def xdel(self, name, *message_ids):
+        name = stream_key(name)
+        stream = self.streams.get(name, [])
+        self.streams[name] = [message for message in stream if message[0] not in message_ids]
+        if name in self.groups:
+            self.groups[name] -= len(stream) - len(self.streams[name])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeStreams()
+    monkeypatch.setattr(streams, 'create_client', lambda **kwargs: client)
+    return client
+
+
+def test_streams_round_trip(client):
+    async def main():
+        router = streams.StreamRouterTransport()
+        balancer = streams.StreamBalancerTransport()
+        await router.init()
+        await balancer.init()
+
+        async def callback(request):
+            await request.reply(request.body + b'/done')
+
+        await balancer.consume(callback)
+        future = await router.publish(b'create/session', balancer.name, timeout=1)
+        assert await future == 'create/session/done'
+        assert len(client.acked) == 1
+        assert client.streams[balancer.stream] == []
+
+        await balancer.close()
+        await router.close()
+        assert balancer.stream not in client.streams
+
+    asyncio.run(main())
+
+
+def test_streams_missing_balancer_cancels(client):
+    async def main():
+        router = streams.StreamRouterTransport()
+        await router.init()
+        future = await router.publish(b'create/session', 'missing', timeout=1)
+        assert future.cancelled()
+        await router.close()
+
+    asyncio.run(main())
+
+
+def test_streams_close_before_consume(client):
+    async def main():
+        balancer = streams.StreamBalancerTransport()
+        await balancer.init()
+        await balancer.close()
+
+    asyncio.run(main())